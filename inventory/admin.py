@@ -1,5 +1,26 @@
 from django.contrib import admin
-from .models import Supplier, Product, Order, OrderItem, Invoice, Vehicle, Driver, UserProfile, ReparationProduct, ReparationProductItem
+from .models import Supplier, Product, Order, OrderItem, Invoice, Vehicle, Driver, UserProfile, ReparationProduct, ReparationProductItem, StockMovement
+
+
+# current_quantity is kept by the stock ledger, change it with a StockMovement
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ('name', 'reference', 'SKU', 'supplier', 'current_quantity', 'low_quantity', 'min_quantity')
+    list_filter = ('supplier',)
+    search_fields = ('name', 'reference', 'SKU')
+    readonly_fields = ('current_quantity',)
+
+
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('date_created', 'product', 'kind', 'quantity', 'order', 'reparation_product', 'note')
+    list_filter = ('kind',)
+    search_fields = ('product__name', 'product__reference', 'note')
+    raw_id_fields = ('product', 'order', 'reparation_product')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 class OrderItemInline(admin.TabularInline):
@@ -56,7 +77,8 @@ admin.site.register(ReparationProductItem, ReparationProductItemAdmin)
 
 admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Supplier)
-admin.site.register(Product)
+admin.site.register(Product, ProductAdmin)
+admin.site.register(StockMovement, StockMovementAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Invoice, InvoiceAdmin)
 admin.site.register(Vehicle, VehicleAdmin)
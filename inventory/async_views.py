@@ -0,0 +1,147 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions, status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .cache import get_versions, last_modified_of, make_etag, not_modified, set_validators
+from .models import Product, Order, Vehicle, Driver
+from .middleware import serialize
+from .pagination import KeysetPagination, LowStockKeysetPagination
+from .serializers import (ProductSerializer, LowStockProductSerializer, OrderReadSerializer, VehicleSerializer,
+                          DriverSerializer)
+
+# Async variants of the hot read endpoints, for the ASGI application
+# (inventory_management/asgi.py). They query with the async ORM, so a
+# process served by an ASGI server keeps answering while requests wait on
+# the database. Responses match the synchronous endpoints, including the
+# keyset pagination and the ETag/304 handling.
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+async def authenticate(request):
+    """
+    The user of a `Token <key>` Authorization header or of the session, with
+    the same errors as the DRF authentication classes in settings.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if header and header[0].lower() == 'token':
+        if len(header) == 1:
+            raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+        if len(header) > 2:
+            raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            token = await Token.objects.select_related('user').aget(key=header[1])
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return token.user
+    # Loading the session user hits the database
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        raise exceptions.NotAuthenticated()
+    return user
+
+
+def async_read_view(cache_models=(), allow_any=False):
+    """
+    Wrap an async view returning serializable data: GET only, DRF-style
+    authentication errors, conditional GET on `cache_models`.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponseNotAllowed(['GET', 'HEAD'])
+            try:
+                if not allow_any:
+                    await authenticate(request)
+            except exceptions.APIException as error:
+                # Session authentication comes first, so DRF answers 403 too
+                return render({'detail': error.detail}, status.HTTP_403_FORBIDDEN)
+
+            etag = last_modified = None
+            if cache_models:
+                versions = await sync_to_async(get_versions)(*cache_models)
+                etag = make_etag(request.build_absolute_uri(), JSONRenderer.format, versions)
+                last_modified = last_modified_of(versions)
+                if not_modified(request.headers, etag, last_modified):
+                    return set_validators(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+            # From format_suffix_patterns; JSON is the only format served here
+            kwargs.pop('format', None)
+            try:
+                data = await view(request, *args, **kwargs)
+            except Http404:
+                return render({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+            except exceptions.APIException as error:
+                return render({'detail': error.detail}, error.status_code)
+            response = render(data)
+            return set_validators(response, etag, last_modified) if etag else response
+        return wrapper
+    return decorator
+
+
+async def paginate(queryset, request, serializer_class, pagination_class=KeysetPagination):
+    paginator = pagination_class()
+    page_queryset = paginator.get_page_queryset(queryset, Request(request))
+    page = paginator.paginate_results([instance async for instance in page_queryset])
+    return paginator.get_paginated_response(serialize(serializer_class(page, many=True))).data
+
+
+async def get_object(queryset, pk):
+    try:
+        return await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+@async_read_view(cache_models=(Product,), allow_any=True)
+async def product_list(request):
+    return await paginate(Product.objects.all(), request, ProductSerializer)
+
+
+@async_read_view(cache_models=(Product,))
+async def product_detail(request, pk):
+    return serialize(ProductSerializer(await get_object(Product.objects.all(), pk)))
+
+
+@async_read_view()
+async def low_stock_product_list(request):
+    return await paginate(Product.objects.low_stock(), request, LowStockProductSerializer, LowStockKeysetPagination)
+
+
+@async_read_view(cache_models=(Vehicle,))
+async def vehicle_list(request):
+    return await paginate(Vehicle.objects.all(), request, VehicleSerializer)
+
+
+@async_read_view(cache_models=(Vehicle,))
+async def vehicle_detail(request, pk):
+    return serialize(VehicleSerializer(await get_object(Vehicle.objects.all(), pk)))
+
+
+@async_read_view()
+async def driver_list(request):
+    return await paginate(Driver.objects.all(), request, DriverSerializer)
+
+
+@async_read_view()
+async def driver_detail(request, pk):
+    return serialize(DriverSerializer(await get_object(Driver.objects.all(), pk)))
+
+
+@async_read_view(cache_models=(Order, Product))
+async def order_detail(request, pk):
+    order = await get_object(Order.objects.all(), pk)
+    # The async ORM has no prefetch_related() in this Django version
+    await sync_to_async(prefetch_related_objects)([order], Order.objects.items_prefetch())
+    return serialize(OrderReadSerializer(order))
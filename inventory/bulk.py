@@ -0,0 +1,68 @@
+from .cache import invalidate
+from .numbers import allocate
+from .models import Order, OrderItem, Invoice, ReparationProduct, ReparationProductItem, ReparationInvoice
+
+
+# Bulk writers for code paths that create many documents at once (imports,
+# the reorder planner). They skip save() and the post_save signals, so
+# everything those would do (numbers, totals, invoices) is done here in bulk.
+# Call them inside a transaction.
+
+def create_orders(documents, batch_size=500):
+    """
+    Insert orders with their line items and invoices.
+
+    `documents` is a list of (order, items) pairs of unsaved instances;
+    the items do not need their order set.
+    """
+    orders = [order for order, _ in documents]
+    Order.assign_numbers_to(orders)
+    Order.objects.bulk_create(orders, batch_size=batch_size)
+
+    items = []
+    for order, order_items in documents:
+        for item in order_items:
+            item.Order = order
+            items.append(item)
+    OrderItem.objects.bulk_create(items, batch_size=batch_size)
+
+    order_ids = [order.pk for order in orders]
+    created = Order.objects.filter(pk__in=order_ids)
+    created.update_totals()
+    totals = dict(created.values_list('pk', 'total_price'))
+    for order in orders:
+        order.total_price = totals[order.pk]
+    Invoice.objects.bulk_create([
+        Invoice(order=order, invoice_number=number, total_price=order.total_price)
+        for order, number in zip(orders, allocate('invoice', len(orders)))
+    ], batch_size=batch_size)
+    invalidate(Order)
+    return orders
+
+
+def create_reparations(documents, batch_size=500):
+    """
+    Insert reparations with their line items and invoices.
+
+    `documents` is a list of (reparation, items) pairs of unsaved instances.
+    """
+    reparations = [reparation for reparation, _ in documents]
+    ReparationProduct.objects.bulk_create(reparations, batch_size=batch_size)
+
+    items = []
+    for reparation, reparation_items in documents:
+        for item in reparation_items:
+            item.reparation_product = reparation
+            items.append(item)
+    ReparationProductItem.objects.bulk_create(items, batch_size=batch_size)
+
+    created = ReparationProduct.objects.filter(pk__in=[reparation.pk for reparation in reparations])
+    created.update_totals()
+    totals = dict(created.values_list('pk', 'total_price'))
+    for reparation in reparations:
+        reparation.total_price = totals[reparation.pk]
+    ReparationInvoice.objects.bulk_create([
+        ReparationInvoice(reparation=reparation, invoice_number=number, total_price=reparation.total_price)
+        for reparation, number in zip(reparations, allocate('reparation_invoice', len(reparations)))
+    ], batch_size=batch_size)
+    return reparations
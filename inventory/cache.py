@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Sequence
+
+# Serialized catalog responses are cached under keys that embed a version
+# token per model. Changing a model bumps its token, which orphans every
+# entry built from the old one; the cache backend evicts those in time.
+# Tokens are Sequence rows, bumped in the transaction that changes the
+# model, so every process sees a change as soon as it is committed. The
+# cached responses themselves may live in a per-process cache.
+CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_name(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def get_versions(*models):
+    """Current version token of each model (0 until it first changes), in one query."""
+    names = [_version_name(model) for model in models]
+    versions = dict(Sequence.objects.filter(name__in=names).values_list('name', 'value'))
+    return [versions.get(name, 0) for name in names]
+
+
+def get_request_versions(request, models):
+    """get_versions() read once per request, for views with several cache mixins."""
+    memo = request.__dict__.setdefault('_cache_versions', {})
+    if models not in memo:
+        memo[models] = get_versions(*models)
+    return memo[models]
+
+
+def bump_version(*models):
+    # Nanosecond timestamp of the change, or one more than the last token if
+    # the clock is behind, so tokens only grow and also date the change
+    names = {_version_name(model) for model in models}
+    tokens = Sequence.objects.db_manager(router.db_for_write(Sequence)).filter(name__in=names)
+    bump = {'value': Greatest(F('value') + 1, Value(time.time_ns()))}
+    if tokens.update(**bump) < len(names):
+        Sequence.objects.bulk_create([Sequence(name=name) for name in names], ignore_conflicts=True)
+        tokens.update(**bump)
+
+
+def invalidate(*models):
+    bump_version(*models)
+
+
+def record(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        hits, misses = _stats['hit'], _stats['miss']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else None}
+
+
+def response_cache_key(models, request):
+    versions = '.'.join(str(version) for version in get_request_versions(request, tuple(models)))
+    # The absolute URI covers the query string and the host used in page links
+    uri = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'inventory:response:{versions}:{uri}'
+
+
+def make_etag(uri, renderer_format, versions):
+    # The rendered format is part of the representation
+    parts = [uri, renderer_format, *(str(version) for version in versions)]
+    return quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+
+def last_modified_of(versions):
+    # Tokens are nanosecond timestamps of the last change. HTTP dates are in
+    # whole seconds, so this is the second after the change; set_validators()
+    # only sends it once that second has passed, so a client holding it has
+    # seen every change made before it, including those of the same second.
+    latest = max(versions, default=0)
+    return latest // 10 ** 9 + 1 if latest else None
+
+
+def not_modified(headers, etag, last_modified):
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        # If-Modified-Since is ignored when If-None-Match is present
+        tags = parse_etags(if_none_match)
+        return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+    if_modified_since = parse_http_date_safe(headers.get('If-Modified-Since', ''))
+    return None not in (if_modified_since, last_modified) and last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None and last_modified <= time.time():
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified support for GET views whose output only depends
+    on `cache_models`. Both are derived from the model version tokens, so
+    an unchanged poll is answered with a 304 after a single tiny query.
+    """
+    cache_models = ()
+
+    def get(self, request, *args, **kwargs):
+        versions = get_request_versions(request, tuple(self.cache_models))
+        etag = make_etag(request.build_absolute_uri(), request.accepted_renderer.format, versions)
+        last_modified = last_modified_of(versions)
+
+        if not_modified(request.headers, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        return set_validators(response, etag, last_modified)
+
+
+class CachedResponseMixin:
+    """
+    Read-through cache for GET responses of views whose output only depends
+    on `cache_models`. Runs after authentication and permission checks.
+    """
+    cache_models = ()
+
+    def get(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = response_cache_key(self.cache_models, request)
+        data = cache.get(key)
+        if data is not None:
+            record('hit')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record('miss')
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
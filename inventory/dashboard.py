@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.utils import timezone
+
+from .cache import get_cache
+from .models import Order, Product, Supplier, VehicleCostRollup
+
+# Seconds the summary is reused for, 0 to always recompute
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 15)
+DASHBOARD_CACHE_KEY = 'inventory:dashboard'
+
+
+def summary():
+    """
+    Figures of the operations dashboard in four small queries. None of them
+    reads line items: order and reparation totals are maintained on the
+    orders and in the vehicle cost rollups.
+    """
+    # Order counts and pending spend come from one scan of the covering
+    # (status, supplier, total_price) index, grouped in the database
+    groups = Order.objects.values('status', 'supplier').annotate(orders=Count('id'), spend=Sum('total_price')).order_by()
+    labels = dict(Order.status_choices)
+    statuses = dict.fromkeys((label.lower() for label in labels.values()), 0)
+    pending = []
+    for group in groups:
+        label = labels.get(group['status'], group['status']).lower()
+        statuses[label] = statuses.get(label, 0) + group['orders']
+        if group['status'] == 'P':
+            pending.append(group)
+    names = dict(Supplier.objects.filter(pk__in=[group['supplier'] for group in pending]).values_list('pk', 'name'))
+    suppliers = [
+        {'supplier': group['supplier'], 'name': names.get(group['supplier']), 'orders': group['orders'], 'spend': group['spend']}
+        for group in sorted(pending, key=lambda group: (-group['spend'], group['supplier']))
+    ]
+
+    stock = Product.objects.aggregate(
+        products=Count('id'),
+        low_stock=Count('id', filter=Q(current_quantity__lte=F('low_quantity'))),
+        critical=Count('id', filter=Q(current_quantity__lte=F('min_quantity'))),
+        out_of_stock=Count('id', filter=Q(current_quantity__lte=0)),
+        valuation=Sum(
+            ExpressionWrapper(F('current_quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+            filter=Q(current_quantity__gt=0),
+        ),
+    )
+
+    # This month's bucket of every vehicle, from the rollup's period index
+    month = timezone.localdate().replace(day=1)
+    reparations = VehicleCostRollup.objects.filter(period=month).aggregate(
+        reparations=Sum('reparations'), spend=Sum('total_cost'),
+    )
+
+    return {
+        'orders_by_status': statuses,
+        'pending_spend_by_supplier': suppliers,
+        'stock': stock,
+        'reparations_this_month': {'month': f'{month:%Y-%m}', **reparations},
+        'generated_at': timezone.now(),
+    }
+
+
+def cached_summary():
+    if not DASHBOARD_CACHE_TIMEOUT:
+        return summary()
+    cache = get_cache()
+    data = cache.get(DASHBOARD_CACHE_KEY)
+    if data is None:
+        data = summary()
+        cache.set(DASHBOARD_CACHE_KEY, data, DASHBOARD_CACHE_TIMEOUT)
+    return data
@@ -0,0 +1,55 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    # Exports are streamed by stream_rows() and errors are rendered as JSON
+    # (see ExportAPIView), so nothing is ever rendered with this
+
+
+class NDJSONRenderer(JSONRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class Echo:
+    """File-like object whose write() hands the line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def stream_rows(queryset, columns, renderer_format, filename, chunk_size=2000):
+    """
+    Stream the queryset as CSV or NDJSON. `columns` maps output names to
+    field lookups; related fields are joined in the same query. Rows are
+    fetched with a server-side iterator, so memory stays flat whatever the size.
+    """
+    names = list(columns)
+    # The body is consumed after the view returns, when the request's read
+    # routing (see inventory/routers.py) no longer applies; resolve it now
+    queryset = queryset.using(queryset.db)
+    rows = queryset.values_list(*columns.values()).iterator(chunk_size=chunk_size)
+    if renderer_format == 'ndjson':
+        body = (json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+        content_type = NDJSONRenderer.media_type
+    else:
+        writer = csv.writer(Echo())
+        body = _csv_lines(writer, names, rows)
+        content_type = CSVRenderer.media_type
+    response = StreamingHttpResponse(body, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{renderer_format}"'
+    return response
+
+
+def _csv_lines(writer, names, rows):
+    yield writer.writerow(names)
+    for row in rows:
+        yield writer.writerow(row)
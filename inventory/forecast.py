@@ -0,0 +1,120 @@
+import datetime as dt
+from itertools import chain
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, ProductForecast, ReparationProduct, ReparationProductItem
+
+try:
+    import numpy as np
+except ImportError:  # Optional, only the forecast job needs it
+    np = None
+
+HISTORY_DAYS = 730
+WINDOW_WEEKS = 8
+ALPHA = 0.3
+MAX_COVER_DAYS = 36500
+
+
+def weekly_consumption(product_ids, start, weeks):
+    """
+    Matrix of items used by reparations, one row per product (in the order
+    of the sorted `product_ids` array) and one column per week since `start`.
+
+    Line items of the period are streamed as plain integers straight into
+    an array (the reparation_date_id_idx index finds their reparations),
+    so memory follows the forecast window rather than the whole history.
+    Each line is placed in its week through its reparation's date:
+    converting one date per reparation is much cheaper than one per line.
+    """
+    since = timezone.make_aware(dt.datetime.combine(start, dt.time()))
+    matrix = np.zeros((len(product_ids), weeks))
+    reparations = list(
+        ReparationProduct.objects.filter(date_repaired__gte=since).order_by('id').values_list('id', 'date_repaired')
+    )
+    if not reparations:
+        return matrix
+    lines = (
+        ReparationProductItem.objects.filter(reparation_product__date_repaired__gte=since)
+        .order_by().values_list('product_id', 'reparation_product_id', 'quantity').iterator()
+    )
+    lines = np.fromiter(chain.from_iterable(lines), dtype=np.int64).reshape(-1, 3)
+    if not len(lines):
+        return matrix
+
+    tz = timezone.get_current_timezone()
+    reparation_ids = np.array([pk for pk, _ in reparations], dtype=np.int64)
+    days = np.array([moment.astimezone(tz).date() for _, moment in reparations], dtype='datetime64[D]')
+    reparation_weeks = np.minimum((days - np.datetime64(start, 'D')).astype(np.int64) // 7, weeks - 1)
+
+    # Both reads share the caller's snapshot, so every line's reparation is listed
+    position = np.searchsorted(reparation_ids, lines[:, 1])
+    rows = np.searchsorted(product_ids, lines[:, 0])
+    # Unbuffered, so several lines of the same product and week add up
+    np.add.at(matrix, (rows, reparation_weeks[position]), lines[:, 2])
+    return matrix
+
+
+def smoothing_weights(weeks, alpha):
+    """
+    Weights w such that matrix @ w is the last value of the recursion
+    s[0] = x[0], s[t] = alpha * x[t] + (1 - alpha) * s[t - 1].
+    """
+    weights = alpha * (1 - alpha) ** np.arange(weeks - 1, -1, -1, dtype=float)
+    weights[0] = (1 - alpha) ** (weeks - 1)
+    return weights
+
+
+def compute_forecasts(history_days=HISTORY_DAYS, window=WINDOW_WEEKS, alpha=ALPHA, today=None):
+    """
+    Forecast every product at once. Returns unsaved ProductForecast
+    instances; nothing is computed per product in Python.
+    """
+    if np is None:
+        raise ImproperlyConfigured('Stock forecasting requires NumPy (pip install numpy).')
+    today = today or timezone.localdate()
+    weeks = max(history_days // 7, 1)
+    # Weeks end today, so the last column is the current week
+    start = today - dt.timedelta(days=weeks * 7 - 1)
+
+    # One snapshot for all reads, so every line's product and reparation is known
+    with transaction.atomic():
+        stock = np.array(list(Product.objects.order_by('id').values_list('id', 'current_quantity')), dtype=np.int64).reshape(-1, 2)
+        product_ids, current = stock[:, 0], stock[:, 1].astype(float)
+        matrix = weekly_consumption(product_ids, start, weeks)
+
+    weekly_average = matrix[:, -min(window, weeks):].mean(axis=1)
+    smoothed = matrix @ smoothing_weights(weeks, alpha)
+    daily_rate = smoothed / 7
+    consuming = daily_rate > 0
+    cover = np.divide(np.maximum(current, 0), daily_rate, out=np.full_like(current, np.nan), where=consuming)
+    # Capped so a trickle of consumption cannot push the date past year 9999
+    stockout = np.datetime64(today, 'D') + np.floor(np.minimum(np.nan_to_num(cover), MAX_COVER_DAYS)).astype('timedelta64[D]')
+
+    computed_at = timezone.now()
+    columns = [product_ids, stock[:, 1], weekly_average, smoothed, daily_rate, cover, stockout, consuming]
+    return [
+        ProductForecast(
+            product_id=product_id,
+            current_quantity=quantity,
+            weekly_average=average,
+            smoothed_weekly=smoothed_weekly,
+            daily_rate=rate,
+            days_of_cover=days if has_rate else None,
+            stockout_date=day if has_rate else None,
+            computed_at=computed_at,
+        )
+        # tolist() turns the columns into plain Python values in one pass each
+        for product_id, quantity, average, smoothed_weekly, rate, days, day, has_rate in zip(
+            *(column.tolist() for column in columns)
+        )
+    ]
+
+
+def store_forecasts(forecasts, batch_size=1000):
+    with transaction.atomic():
+        ProductForecast.objects.all().delete()
+        ProductForecast.objects.bulk_create(forecasts, batch_size=batch_size)
+    return len(forecasts)
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+
+from .cache import get_versions
+from .models import Product
+from .serializers import ProductSerializer
+
+LOOKUP_CACHE_SIZE = getattr(settings, 'PRODUCT_LOOKUP_CACHE_SIZE', 4096)
+LOOKUP_CACHE_TTL = getattr(settings, 'PRODUCT_LOOKUP_CACHE_TTL', 60)
+
+
+class ProductLookupCache:
+    """
+    In-process LRU of serialized products by scanned code (SKU or
+    reference). Unknown codes are cached too. Everything is dropped when
+    the Product version token (kept in the database, so shared by every
+    process) changes. Entries also expire after `ttl` seconds, which bounds
+    staleness after writes that bypass the token, e.g. raw updates.
+    """
+
+    def __init__(self, maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, codes, version):
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            for code in codes:
+                if code not in self.entries:
+                    continue
+                value, expires = self.entries[code]
+                if expires <= now:
+                    del self.entries[code]
+                    continue
+                self.entries.move_to_end(code)
+                found[code] = value
+        return found
+
+    def set_many(self, values, version):
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries.update((code, (value, expires)) for code, value in values.items())
+            for code in values:
+                self.entries.move_to_end(code)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+_cache = ProductLookupCache()
+
+
+def lookup_products(codes):
+    """
+    Map each code to the serialized product whose SKU or reference it is
+    (a SKU match wins), or None. Codes missing from the cache are resolved
+    together in one query on the unique SKU and reference indexes.
+    """
+    version, = get_versions(Product)
+    results = _cache.get_many(codes, version)
+    missing = [code for code in codes if code not in results]
+    if missing:
+        products = Product.objects.filter(Q(SKU__in=missing) | Q(reference__in=missing))
+        by_reference = {}
+        by_sku = {}
+        for product in products:
+            data = ProductSerializer(product).data
+            by_reference[product.reference] = data
+            by_sku[product.SKU] = data
+        resolved = {code: by_sku.get(code, by_reference.get(code)) for code in missing}
+        _cache.set_many(resolved, version)
+        results.update(resolved)
+    return results
@@ -0,0 +1,109 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from inventory.models import Product, Order, Vehicle, Driver
+
+# Endpoint: (sync url name, async url name, model of the object to fetch or None)
+ENDPOINTS = {
+    'products': ('product_list', 'async_product_list', None),
+    'product': ('product_detail', 'async_product_detail', Product),
+    'low-stock': ('product_low_stock', 'async_product_low_stock', None),
+    'order': ('order_detail', 'async_order_detail', Order),
+    'vehicles': ('vehicle_list', 'async_vehicle_list', None),
+    'vehicle': ('vehicle_detail', 'async_vehicle_detail', Vehicle),
+    'drivers': ('driver_list', 'async_driver_list', None),
+    'driver': ('driver_detail', 'async_driver_detail', Driver),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the latency and throughput of a read endpoint through the WSGI handler '
+        '(sync view, one thread per concurrent request) and the ASGI handler (async view)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoint', choices=sorted(ENDPOINTS), help='Endpoint to request')
+        parser.add_argument('--requests', type=int, default=500, help='Requests sent to each variant')
+        parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight at once')
+        parser.add_argument('--user', help='Username to authenticate as (not needed for products)')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        sync_name, async_name, model = ENDPOINTS[options['endpoint']]
+        url_args = []
+        if model is not None:
+            pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+            if pk is None:
+                raise CommandError(f'There is no {model._meta.verbose_name} to fetch.')
+            url_args = [pk]
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Unknown user {options['user']!r}.")
+
+        # Lets the test clients build requests for the "testserver" host
+        setup_test_environment()
+        results = [
+            ('WSGI/sync', self.run_sync(reverse(sync_name, args=url_args), user, options)),
+            ('ASGI/async', asyncio.run(self.run_async(reverse(async_name, args=url_args), user, options))),
+        ]
+        for label, (elapsed, timings, statuses) in results:
+            timings.sort()
+            self.stdout.write(
+                f"{label:<11} {len(timings) / elapsed:8.1f} req/s  "
+                f"p50 {statistics.median(timings) * 1000:7.2f}ms  "
+                f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f}ms  "
+                f"status {', '.join(f'{code}x{count}' for code, count in sorted(statuses.items()))}"
+            )
+
+    def run_sync(self, url, user, options):
+        local = threading.local()
+
+        def request(_):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                if user is not None:
+                    local.client.force_login(user)
+            started = time.perf_counter()
+            response = local.client.get(url)
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            outcomes = list(executor.map(request, range(options['requests'])))
+        return self.summarize(time.perf_counter() - started, outcomes)
+
+    async def run_async(self, url, user, options):
+        client = AsyncClient()
+        if user is not None:
+            await asyncio.to_thread(client.force_login, user)
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def request():
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(url)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(request() for _ in range(options['requests'])))
+        return self.summarize(time.perf_counter() - started, outcomes)
+
+    def summarize(self, elapsed, outcomes):
+        statuses = {}
+        for _, code in outcomes:
+            statuses[code] = statuses.get(code, 0) + 1
+        return elapsed, [timing for timing, _ in outcomes], statuses
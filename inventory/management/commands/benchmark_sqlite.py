@@ -0,0 +1,92 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+# The stock backend as Django configures it when DATABASES has no OPTIONS
+STOCK = {'ENGINE': 'django.db.backends.sqlite3', 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a mixed read/write workload from several threads against a scratch SQLite file, '
+        'once with the stock sqlite3 backend and once with the DATABASES settings of --database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Alias whose engine and settings are measured')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent workers, each one a "request" loop')
+        parser.add_argument('--requests', type=int, default=250, help='Requests made by each worker')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of requests that write')
+        parser.add_argument('--rows', type=int, default=20000, help='Rows in the scratch table')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['requests'] < 1:
+            raise CommandError('--threads and --requests must be at least 1.')
+        if not 0 <= options['write_ratio'] <= 1:
+            raise CommandError('--write-ratio must be between 0 and 1.')
+        configured = connections.settings[options['database']]
+        if configured['ENGINE'] not in ('django.db.backends.sqlite3', 'inventory_management.db.sqlite3'):
+            raise CommandError(f"{options['database']!r} is not an SQLite database.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            for label, settings_dict in [('stock', STOCK), (options['database'], configured)]:
+                alias = f'benchmark_{label}'
+                name = os.path.join(directory, f'{label}.sqlite3')
+                connections.settings[alias] = {**configured, **settings_dict, 'NAME': name}
+                connections.configure_settings(connections.settings)
+                try:
+                    self.populate(alias, options['rows'])
+                    elapsed, done, locked = self.run(alias, options)
+                finally:
+                    connections.close_all()
+                    del connections.settings[alias]
+                self.stdout.write(
+                    f"{label:<10} {done / elapsed:8.1f} req/s  {done} ok  {locked} 'database is locked'"
+                )
+
+    def populate(self, alias, rows):
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE stock (id INTEGER PRIMARY KEY, quantity INTEGER NOT NULL)')
+            cursor.executemany('INSERT INTO stock (quantity) VALUES (%s)', [(100,)] * rows)
+
+    def run(self, alias, options):
+        rows, ratio = options['rows'], options['write_ratio']
+        counts = {'done': 0, 'locked': 0}
+        lock = threading.Lock()
+
+        def worker(number):
+            done = locked = 0
+            for request in range(options['requests']):
+                pk = (number * options['requests'] + request) % rows + 1
+                try:
+                    # Spreads the writes evenly over the requests
+                    if int((request + 1) * ratio) > int(request * ratio):
+                        # Read then write, like Order.save() updating a total
+                        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                            cursor.execute('SELECT quantity FROM stock WHERE id = %s', [pk])
+                            quantity, = cursor.fetchone()
+                            cursor.execute('UPDATE stock SET quantity = %s WHERE id = %s', [quantity - 1, pk])
+                    else:
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute('SELECT COUNT(*), SUM(quantity) FROM stock WHERE id BETWEEN %s AND %s',
+                                           [pk, pk + 500])
+                            cursor.fetchone()
+                    done += 1
+                except OperationalError:
+                    locked += 1
+                # What request_finished does: close unless CONN_MAX_AGE keeps it
+                connections[alias].close_if_unusable_or_obsolete()
+            connections[alias].close()
+            with lock:
+                counts['done'] += done
+                counts['locked'] += locked
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(worker, range(options['threads'])))
+        return time.perf_counter() - started, counts['done'], counts['locked']
@@ -0,0 +1,30 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.forecast import ALPHA, HISTORY_DAYS, WINDOW_WEEKS, compute_forecasts, store_forecasts
+
+
+class Command(BaseCommand):
+    help = 'Forecast days of cover and stock-out dates of every product from reparation consumption (needs NumPy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history-days', type=int, default=HISTORY_DAYS, help='Days of consumption history to use')
+        parser.add_argument('--window', type=int, default=WINDOW_WEEKS, help='Weeks in the moving average')
+        parser.add_argument('--alpha', type=float, default=ALPHA, help='Exponential smoothing factor, between 0 and 1')
+
+    def handle(self, *args, **options):
+        if not 0 < options['alpha'] <= 1:
+            raise CommandError('--alpha must be in (0, 1].')
+        if options['history_days'] < 7 or options['window'] < 1:
+            raise CommandError('--history-days must be at least 7 and --window at least 1.')
+        started = time.monotonic()
+        try:
+            forecasts = compute_forecasts(options['history_days'], options['window'], options['alpha'])
+        except ImproperlyConfigured as error:
+            raise CommandError(str(error))
+        stored = store_forecasts(forecasts)
+        self.stdout.write(self.style.SUCCESS(
+            f"Forecast {stored} products in {time.monotonic() - started:.2f}s."
+        ))
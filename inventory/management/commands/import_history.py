@@ -0,0 +1,239 @@
+import csv
+import datetime as dt
+import json
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import groupby
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from inventory.bulk import create_orders, create_reparations
+from inventory.models import (Product, Supplier, Order, OrderItem, Vehicle, Driver,
+                              ReparationProduct, ReparationProductItem)
+
+ORDER_STATUSES = {code for code, _ in Order.status_choices}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+
+class RowError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Import historical orders or reparations from a CSV or NDJSON file. '
+        'Rows are line items; consecutive rows with the same order_number '
+        '(orders) or license_plate and date_repaired (reparations) form one document.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['orders', 'reparations'], help='What the file contains')
+        parser.add_argument('path', type=str, help='Path to the .csv or .ndjson file')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Input format, guessed from the extension by default')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Documents written per transaction')
+        parser.add_argument('--strict', action='store_true', help='Abort on the first invalid document instead of skipping it')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        self.strict = options['strict']
+        self.chunk_size = options['chunk_size']
+        self.verbosity = options['verbosity']
+        self.load_lookups(options['kind'])
+
+        if options['kind'] == 'orders':
+            key, build, write = (lambda row: row.get('order_number')), self.build_order, create_orders
+            fields = [Order._meta.get_field('date_ordered'), Order._meta.get_field('date_delivered')]
+        else:
+            key, build, write = (lambda row: (row.get('license_plate'), row.get('date_repaired'))), self.build_reparation, create_reparations
+            fields = [ReparationProduct._meta.get_field('date_repaired')]
+
+        self.rows = self.documents = self.skipped = 0
+        started = time.monotonic()
+        try:
+            with open(path, newline='', encoding='utf-8') as handle:
+                rows = self.read_rows(handle, input_format)
+                buffer = []
+                with historical_dates(fields):
+                    for _, lines in groupby(rows, key=key):
+                        document = self.build_document(build, list(lines))
+                        if document is not None:
+                            buffer.append(document)
+                        if len(buffer) >= self.chunk_size:
+                            self.flush(write, buffer, started)
+                            buffer = []
+                    if buffer:
+                        self.flush(write, buffer, started)
+        except OSError as exc:
+            raise CommandError(f"Cannot read '{path}': {exc}")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.documents} {options['kind']} ({self.rows} rows) in {elapsed:.1f}s, "
+            f"{self.rows / elapsed if elapsed else 0:.0f} rows/sec; {self.skipped} skipped."
+        ))
+
+    def load_lookups(self, kind):
+        # Natural key -> id maps, sized by the catalog rather than by the file
+        self.products = dict(Product.objects.values_list('reference', 'id'))
+        if kind == 'orders':
+            self.suppliers = dict(Supplier.objects.order_by('-id').values_list('name', 'id'))
+        else:
+            self.vehicles = dict(Vehicle.objects.exclude(license_plate=None).values_list('license_plate', 'id'))
+            self.drivers = dict(Driver.objects.order_by('-id').values_list('name', 'id'))
+
+    def read_rows(self, handle, input_format):
+        if input_format == 'csv':
+            yield from csv.DictReader(handle)
+            return
+        for number, line in enumerate(handle, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    raise CommandError(f'Line {number} is not valid JSON: {exc}')
+                if not isinstance(row, dict):
+                    raise CommandError(f'Line {number} is not a JSON object')
+                yield row
+
+    def build_document(self, build, lines):
+        self.rows += len(lines)
+        try:
+            return build(lines)
+        except RowError as exc:
+            if self.strict:
+                raise CommandError(str(exc))
+            self.skipped += 1
+            if self.verbosity >= 1:
+                self.stderr.write(f'Skipped: {exc}')
+            return None
+
+    def build_order(self, lines):
+        head = lines[0]
+        number = head.get('order_number')
+        if not number:
+            raise RowError('order without order_number')
+        if head.get('supplier') not in self.suppliers:
+            raise RowError(f"order {number}: unknown supplier '{head.get('supplier')}'")
+        status = head.get('status') or 'P'
+        if status not in ORDER_STATUSES:
+            raise RowError(f"order {number}: unknown status '{status}'")
+        order = Order(
+            order_number=number,
+            supplier_id=self.suppliers[head['supplier']],
+            date_ordered=to_datetime(head.get('date_ordered'), f'order {number}', required=True),
+            date_delivered=to_datetime(head.get('date_delivered'), f'order {number}'),
+            is_delivered=str(head.get('is_delivered', '')).lower() in TRUE_VALUES,
+            status=status,
+            delivery_order_number=head.get('delivery_order_number') or None,
+        )
+        return f'order {number}', order, [OrderItem(**self.line(line, f'order {number}')) for line in lines]
+
+    def build_reparation(self, lines):
+        head = lines[0]
+        label = f"reparation {head.get('license_plate')} {head.get('date_repaired')}"
+        if head.get('license_plate') not in self.vehicles:
+            raise RowError(f"{label}: unknown vehicle '{head.get('license_plate')}'")
+        if head.get('driver') not in self.drivers:
+            raise RowError(f"{label}: unknown driver '{head.get('driver')}'")
+        reparation = ReparationProduct(
+            vehicle_id=self.vehicles[head['license_plate']],
+            driver_id=self.drivers[head['driver']],
+            date_repaired=to_datetime(head.get('date_repaired'), label, required=True),
+            odometer=to_int(head.get('odometer'), label, required=False),
+            location=head.get('location') or None,
+        )
+        return label, reparation, [ReparationProductItem(**self.line(line, label)) for line in lines]
+
+    def line(self, row, label):
+        reference = row.get('product_reference')
+        if reference not in self.products:
+            raise RowError(f"{label}: unknown product reference '{reference}'")
+        return {'product_id': self.products[reference], 'quantity': to_int(row.get('quantity'), label)}
+
+    def flush(self, write, documents, started):
+        """Write (label, head, items) documents in one transaction."""
+        try:
+            with transaction.atomic():
+                write([(head, items) for _, head, items in documents], batch_size=self.chunk_size)
+            self.documents += len(documents)
+        except IntegrityError as exc:
+            if self.strict:
+                raise CommandError(
+                    f'Chunk after {self.documents} imported documents was rolled back, '
+                    f'it clashes with existing data: {exc}'
+                )
+            # Find the documents that clash, each in its own savepoint
+            with transaction.atomic():
+                for label, head, items in documents:
+                    unsave(head, *items)
+                    try:
+                        with transaction.atomic():
+                            write([(head, items)], batch_size=self.chunk_size)
+                    except IntegrityError as exc:
+                        self.skipped += 1
+                        if self.verbosity >= 1:
+                            self.stderr.write(f'Skipped: {label}: clashes with existing data: {exc}')
+                    else:
+                        self.documents += 1
+        if self.verbosity >= 2:
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{self.documents} documents, {self.rows / elapsed:.0f} rows/sec')
+
+
+def to_datetime(value, label, required=False):
+    if not value:
+        if required:
+            raise RowError(f'{label}: missing date')
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None and parse_date(value) is not None:
+            parsed = dt.datetime.combine(parse_date(value), dt.time())
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise RowError(f"{label}: invalid date '{value}'")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def to_int(value, label, required=True):
+    if value in (None, ''):
+        if required:
+            raise RowError(f'{label}: missing quantity')
+        return None
+    try:
+        number = Decimal(str(value))
+        integer = int(number)
+    # NaN raises ValueError and Infinity OverflowError (an ArithmeticError)
+    except (ArithmeticError, ValueError):
+        raise RowError(f"{label}: invalid number '{value}'")
+    if integer != number:
+        raise RowError(f"{label}: '{value}' is not a whole number")
+    return integer
+
+
+def unsave(*instances):
+    # Rolled back bulk_create() leaves the instances with the ids they had
+    for instance in instances:
+        instance.pk = None
+        instance._state.adding = True
+
+
+@contextmanager
+def historical_dates(fields):
+    # auto_now/auto_now_add would overwrite the imported dates on insert
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
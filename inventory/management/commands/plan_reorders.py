@@ -0,0 +1,37 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.reorder import plan_reorders, create_reorders
+
+
+class Command(BaseCommand):
+    help = 'Plan reorders for products below min_quantity, grouped by preferred supplier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--commit', action='store_true', help='Create the pending orders instead of only printing the plan')
+
+    def handle(self, *args, **kwargs):
+        # Planned in the transaction that creates the orders, see reorder()
+        with transaction.atomic() if kwargs['commit'] else nullcontext():
+            self.plan(commit=kwargs['commit'])
+
+    def plan(self, commit):
+        lines, unassigned = plan_reorders()
+        for line in lines:
+            product = line.product
+            self.stdout.write(
+                f"{product.supplier}: {product.reference} {product.name} - "
+                f"{line.units} unit(s) for a shortfall of {line.shortfall}"
+            )
+        for product in unassigned:
+            self.stdout.write(self.style.WARNING(f"{product.reference} {product.name} needs reordering but has no supplier"))
+
+        if not commit:
+            self.stdout.write(f"{len(lines)} line(s) planned, run with --commit to create the orders.")
+            return
+        orders = create_reorders(lines)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(orders)} pending order(s): {', '.join(order.order_number for order in orders)}"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.stock import rebuild_quantities
+
+
+class Command(BaseCommand):
+    help = 'Recompute Product.current_quantity from the stock movement ledger'
+
+    def handle(self, *args, **kwargs):
+        updated = rebuild_quantities()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the stock quantity of {updated} products."))
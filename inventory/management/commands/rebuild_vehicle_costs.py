@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import VehicleCostRollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-vehicle monthly cost rollups from the reparations'
+
+    def handle(self, *args, **kwargs):
+        created = VehicleCostRollup.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} vehicle cost rollups."))
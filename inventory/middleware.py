@@ -0,0 +1,229 @@
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.response import Response
+
+from .routers import primary_reads, replica_reads
+
+logger = logging.getLogger(__name__)
+
+# Seconds a client keeps reading from the primary after a write, so it sees
+# its own changes even if the replica lags behind (e.g. a snapshot copy)
+READ_YOUR_WRITES_SECONDS = getattr(settings, 'REPLICA_READ_YOUR_WRITES_SECONDS', 5)
+PRIMARY_COOKIE = 'read_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def wants_primary(request):
+    """True when the client asks for primary reads (?primary=1, X-Read-Primary) or wrote recently."""
+    return (
+        request.GET.get('primary') in ('1', 'true')
+        or request.headers.get('X-Read-Primary', '').lower() in ('1', 'true')
+        or PRIMARY_COOKIE in request.COOKIES
+    )
+
+
+class ReplicaReadMiddleware:
+    """
+    Route the reads of safe requests to the read-only replica, see
+    inventory/routers.py. Unsafe requests read and write on the primary,
+    and a successful one keeps the client on the primary for a few seconds.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in SAFE_METHODS and not wants_primary(request):
+            with replica_reads():
+                return self.get_response(request)
+
+        with primary_reads():
+            response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and READ_YOUR_WRITES_SECONDS:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+
+# Collapses the values that vary between executions of the same statement
+_FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)'), '(...)'),
+]
+
+
+def fingerprint(sql):
+    for pattern, replacement in _FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class QueryRecorder:
+    """Execute wrapper timing every query and counting them by fingerprint."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+class SerializationTimer:
+    """
+    Time spent building `serializer.data` in the views that measure it, less
+    the queries it ran (lazy relations), which the QueryRecorder already
+    counts.
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.duration = 0.0
+        self.measured = False
+
+
+_serialization_timer = ContextVar('serialization_timer', default=None)
+
+
+@contextmanager
+def measure_serialization():
+    """Add the time spent in the block to the serialization time of a sampled request."""
+    timer = _serialization_timer.get()
+    if timer is None:
+        yield
+        return
+    started, queries = time.perf_counter(), timer.recorder.duration
+    try:
+        yield
+    finally:
+        timer.duration += time.perf_counter() - started - (timer.recorder.duration - queries)
+        timer.measured = True
+
+
+def serialize(serializer):
+    """`serializer.data`, measured for QueryProfilingMiddleware."""
+    with measure_serialization():
+        return serializer.data
+
+
+class SerializationTimingMixin:
+    """
+    DRF's list() and retrieve(), with `serializer.data` measured, so
+    profiled responses of the view report a serialize timing.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize(self.get_serializer(page, many=True)))
+        return Response(serialize(self.get_serializer(queryset, many=True)))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(serialize(self.get_serializer(self.get_object())))
+
+
+class QueryProfilingMiddleware:
+    """
+    Profile a sample of the requests: query count, time spent in the
+    database, rendering and, for views using SerializationTimingMixin,
+    serialization, and statements repeated often enough to be an N+1. Sampled responses carry a Server-Timing header, and
+    requests over the thresholds in settings are logged. Streamed responses
+    are profiled until their body is closed; they are only logged, as their
+    headers are sent before the body runs its queries. Unsampled requests
+    cost one random() call.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_PROFILING_SAMPLE_RATE', 0.05)
+        self.slow_ms = getattr(settings, 'QUERY_PROFILING_SLOW_MS', 500)
+        self.max_queries = getattr(settings, 'QUERY_PROFILING_MAX_QUERIES', 50)
+        self.max_duplicates = getattr(settings, 'QUERY_PROFILING_MAX_DUPLICATES', 5)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        timer = SerializationTimer(recorder)
+        request._profiling_render = 0.0
+        started = time.perf_counter()
+        token = _serialization_timer.set(timer)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+                if response.streaming and not response.is_async:
+                    # The body runs its queries after this returns; keep the wrappers until it is closed
+                    response.streaming_content = self.profile_stream(
+                        response.streaming_content, stack.pop_all(), request, recorder, timer, started,
+                    )
+                    return response
+        finally:
+            _serialization_timer.reset(token)
+        timings = self.timings(request, recorder, timer, time.perf_counter() - started)
+        names = ('serialize', 'render', 'app', 'total') if timer.measured else ('render', 'app', 'total')
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings["db"]:.1f};desc="{recorder.count} queries"',
+            *(f'{name};dur={timings[name]:.1f}' for name in names),
+        ])
+        self.log(request, recorder, timings)
+        return response
+
+    def profile_stream(self, content, stack, request, recorder, timer, started):
+        try:
+            yield from content
+        finally:
+            stack.close()
+            self.log(request, recorder, self.timings(request, recorder, timer, time.perf_counter() - started))
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time the rendering
+        if hasattr(request, '_profiling_render'):
+            started = time.perf_counter()
+
+            def rendered(response):
+                request._profiling_render += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def timings(self, request, recorder, timer, total):
+        """Milliseconds spent in each part of the request; app is the rest."""
+        timings = {
+            'db': recorder.duration * 1000,
+            'serialize': timer.duration * 1000,
+            'render': request._profiling_render * 1000,
+            'total': total * 1000,
+        }
+        timings['app'] = timings['total'] - timings['db'] - timings['serialize'] - timings['render']
+        return timings
+
+    def log(self, request, recorder, timings):
+        duplicates = [
+            (sql, count) for sql, count in recorder.fingerprints.most_common() if count >= self.max_duplicates
+        ]
+        if timings['total'] >= self.slow_ms or recorder.count >= self.max_queries or duplicates:
+            logger.warning(
+                '%s %s: %d queries, %.1fms in the database, %.1fms serializing, %.1fms rendering, %.1fms total%s',
+                request.method, request.get_full_path(), recorder.count, timings['db'], timings['serialize'],
+                timings['render'], timings['total'],
+                ''.join(f'\n  repeated {count}x: {sql}' for sql, count in duplicates),
+            )
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_alter_reparationproduct_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_ordered', 'id'], name='order_date_ordered_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reparationproduct',
+            index=models.Index(fields=['date_repaired', 'id'], name='reparation_date_id_idx'),
+        ),
+    ]
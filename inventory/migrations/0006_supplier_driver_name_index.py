@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_order_reparation_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='driver',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='supplier',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
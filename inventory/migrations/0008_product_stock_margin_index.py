@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:41
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_stock_movement_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.expressions.CombinedExpression(models.F('current_quantity'), '-', models.F('low_quantity')), models.F('id'), name='product_stock_margin_idx'),
+        ),
+    ]
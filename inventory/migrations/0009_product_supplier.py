@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_product_stock_margin_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='supplier',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='products', to='inventory.supplier'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+# The FTS5 index of inventory/search.py. The statements are frozen here
+# rather than imported, so later changes to the app cannot change what this
+# migration did. It is SQLite only, hence RunPython instead of RunSQL.
+SEARCH_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS inventory_product_fts USING fts5(
+        name, reference, SKU,
+        content='inventory_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_product_fts_ai AFTER INSERT ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(rowid, name, reference, SKU) VALUES (new.id, new.name, new.reference, new.SKU);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_product_fts_ad AFTER DELETE ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(inventory_product_fts, rowid, name, reference, SKU) VALUES ('delete', old.id, old.name, old.reference, old.SKU);
+    END""",
+    # Stock updates do not touch the indexed columns and skip this trigger
+    """CREATE TRIGGER IF NOT EXISTS inventory_product_fts_au AFTER UPDATE OF name, reference, SKU ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(inventory_product_fts, rowid, name, reference, SKU) VALUES ('delete', old.id, old.name, old.reference, old.SKU);
+        INSERT INTO inventory_product_fts(rowid, name, reference, SKU) VALUES (new.id, new.name, new.reference, new.SKU);
+    END""",
+    "INSERT INTO inventory_product_fts(inventory_product_fts) VALUES ('rebuild')",
+]
+
+
+def forwards(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SEARCH_INDEX:
+            schema_editor.execute(statement)
+
+
+def backwards(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS inventory_product_fts_{suffix}')
+        schema_editor.execute('DROP TABLE IF EXISTS inventory_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_product_supplier'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:48
+
+import uuid
+
+from django.db import migrations, models
+
+# As created by 0010_product_search_index, frozen at that version
+SEARCH_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS inventory_product_fts USING fts5(
+        name, reference, SKU,
+        content='inventory_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_product_fts_ai AFTER INSERT ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(rowid, name, reference, SKU) VALUES (new.id, new.name, new.reference, new.SKU);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS inventory_product_fts_ad AFTER DELETE ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(inventory_product_fts, rowid, name, reference, SKU) VALUES ('delete', old.id, old.name, old.reference, old.SKU);
+    END""",
+    # Stock updates do not touch the indexed columns and skip this trigger
+    """CREATE TRIGGER IF NOT EXISTS inventory_product_fts_au AFTER UPDATE OF name, reference, SKU ON inventory_product BEGIN
+        INSERT INTO inventory_product_fts(inventory_product_fts, rowid, name, reference, SKU) VALUES ('delete', old.id, old.name, old.reference, old.SKU);
+        INSERT INTO inventory_product_fts(rowid, name, reference, SKU) VALUES (new.id, new.name, new.reference, new.SKU);
+    END""",
+    "INSERT INTO inventory_product_fts(inventory_product_fts) VALUES ('rebuild')",
+]
+
+
+def assign_missing_skus(apps, schema_editor):
+    # Blank and duplicated SKUs get a fresh one; the oldest product keeps its SKU
+    Product = apps.get_model('inventory', 'Product')
+    seen = set()
+    changed = []
+    for product in Product.objects.order_by('pk').only('pk', 'name', 'reference', 'SKU'):
+        if not product.SKU or product.SKU in seen:
+            stem = product.name[:3].upper() + ''.join(filter(str.isdigit, product.reference))[-3:]
+            product.SKU = stem + str(uuid.uuid4().int)[:4]
+            while product.SKU in seen or Product.objects.filter(SKU=product.SKU).exists():
+                product.SKU = stem + str(uuid.uuid4().int)[:4]
+            changed.append(product)
+        seen.add(product.SKU)
+    Product.objects.bulk_update(changed, ['SKU'], batch_size=500)
+
+
+def restore_search_index(apps, schema_editor):
+    # Altering the field rebuilds inventory_product on SQLite, dropping the search triggers
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SEARCH_INDEX:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_missing_skus, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='SKU',
+            field=models.CharField(blank=True, editable=False, max_length=50, unique=True),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
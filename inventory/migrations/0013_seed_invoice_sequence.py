@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.db.models import Max
+
+
+def seed_invoice_sequence(apps, schema_editor):
+    # Order invoices used to be numbered INV-<order id>. Starting the
+    # sequence above the highest order id keeps new numbers clear of them.
+    Order = apps.get_model('inventory', 'Order')
+    Sequence = apps.get_model('inventory', 'Sequence')
+    highest = Order.objects.aggregate(highest=Max('pk'))['highest'] or 0
+    Sequence.objects.update_or_create(name='document:invoice', defaults={'value': highest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_invoice_sequence, migrations.RunPython.noop),
+    ]
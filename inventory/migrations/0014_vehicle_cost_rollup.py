@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:52
+
+from django.db import migrations, models
+import django.db.models.functions
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    # Same grouping as VehicleCostRollup.objects.rebuild()
+    ReparationProduct = apps.get_model('inventory', 'ReparationProduct')
+    VehicleCostRollup = apps.get_model('inventory', 'VehicleCostRollup')
+    groups = (
+        ReparationProduct.objects.order_by()
+        .annotate(period=models.functions.TruncMonth('date_repaired', output_field=models.DateField()))
+        .values('vehicle_id', 'period')
+        .annotate(
+            total_cost=models.Sum('total_price'),
+            reparations=models.Count('id'),
+            min_odometer=models.Min('odometer'),
+            max_odometer=models.Max('odometer'),
+        )
+    )
+    VehicleCostRollup.objects.bulk_create([VehicleCostRollup(**values) for values in groups], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_seed_invoice_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleCostRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('total_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('reparations', models.IntegerField(default=0)),
+                ('min_odometer', models.IntegerField(blank=True, null=True)),
+                ('max_odometer', models.IntegerField(blank=True, null=True)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_rollups', to='inventory.vehicle')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'vehicle'], name='rollup_period_vehicle_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='vehiclecostrollup',
+            constraint=models.UniqueConstraint(fields=('vehicle', 'period'), name='rollup_vehicle_period_unique'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
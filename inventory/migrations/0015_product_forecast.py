@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_vehicle_cost_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductForecast',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='inventory.product')),
+                ('current_quantity', models.IntegerField()),
+                ('weekly_average', models.FloatField()),
+                ('smoothed_weekly', models.FloatField()),
+                ('daily_rate', models.FloatField()),
+                ('days_of_cover', models.FloatField(blank=True, null=True)),
+                ('stockout_date', models.DateField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['days_of_cover', 'product'], name='forecast_cover_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+import time
+
+from django.db import migrations
+
+# Models whose changes invalidate cached responses (see inventory/cache.py)
+VERSIONED_MODELS = ['product', 'supplier', 'vehicle', 'driver', 'order']
+
+
+def seed_cache_versions(apps, schema_editor):
+    # With the rows in place a bump is always a single UPDATE
+    Sequence = apps.get_model('inventory', 'Sequence')
+    Sequence.objects.bulk_create(
+        [Sequence(name=f'version:inventory.{model}', value=time.time_ns()) for model in VERSIONED_MODELS],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_order_status_supplier_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_cache_versions, migrations.RunPython.noop),
+    ]
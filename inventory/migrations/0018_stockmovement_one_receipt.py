@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:51
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_receipts(apps, schema_editor):
+    # Receipts used to be written per order item, so an order listing a
+    # product twice has two; keep the first with their sum
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    duplicates = (
+        StockMovement.objects.filter(kind='R', order__isnull=False)
+        .values('order', 'product').order_by()
+        .annotate(count=Count('id'), first=Min('id'), total=Sum('quantity'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        StockMovement.objects.filter(pk=duplicate['first']).update(quantity=duplicate['total'])
+        StockMovement.objects.filter(
+            kind='R', order=duplicate['order'], product=duplicate['product'],
+        ).exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_seed_cache_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_receipts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='stockmovement',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'R')), fields=('order', 'product'), name='movement_one_receipt_per_order_product'),
+        ),
+    ]
@@ -1,7 +1,11 @@
 import datetime as dt
+import re
+from collections import defaultdict
+from decimal import Decimal
 from django.utils import timezone
 import uuid
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.functions import Coalesce, TruncMonth
 from django.contrib.auth.models import User
 from django.forms import ValidationError
 from django.urls import reverse
@@ -31,6 +35,55 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 
+class SequenceQuerySet(models.QuerySet):
+    # Sequences per UPDATE, keeps the CASE under SQLite's bound parameter limit
+    chunk_size = 400
+
+    def reserve(self, counts):
+        """
+        Reserve `counts[name]` consecutive values from each named sequence
+        and return them as a range per name. Takes three queries whatever
+        the number of sequences; the UPDATE locks the rows, so concurrent
+        callers always get disjoint blocks.
+        """
+        counts = {name: count for name, count in counts.items() if count > 0}
+        if not counts:
+            return {}
+        names = list(counts)
+        # self.db is the read database, which may be a read-only replica
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            self.bulk_create([Sequence(name=name) for name in names], ignore_conflicts=True)
+            for start in range(0, len(names), self.chunk_size):
+                chunk = names[start:start + self.chunk_size]
+                self.filter(name__in=chunk).update(value=models.F('value') + models.Case(
+                    *[models.When(name=name, then=models.Value(counts[name])) for name in chunk],
+                    default=models.Value(0), output_field=models.BigIntegerField(),
+                ))
+            values = dict(self.filter(name__in=names).values_list('name', 'value'))
+        return {name: range(values[name] - count + 1, values[name] + 1) for name, count in counts.items()}
+
+
+# Named counters for identifiers that must never repeat (SKUs, document numbers)
+class Sequence(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    objects = SequenceQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class ProductQuerySet(models.QuerySet):
+    def low_stock(self):
+        # Must match the expression of product_stock_margin_idx to use it
+        return (
+            self.annotate(stock_margin=models.F('current_quantity') - models.F('low_quantity'))
+            .filter(stock_margin__lte=0)
+            .order_by('stock_margin', 'id')
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
     reference = models.CharField(max_length=50, unique=True)
@@ -39,23 +92,62 @@ class Product(models.Model):
     min_quantity = models.IntegerField()
     low_quantity = models.IntegerField()
     current_quantity = models.IntegerField(default=0)
-    SKU = models.CharField(max_length=50, editable=False, blank=True)
+    SKU = models.CharField(max_length=50, editable=False, blank=True, unique=True)
+    # Preferred supplier, used by the reorder planner
+    supplier = models.ForeignKey('Supplier', on_delete=models.SET_NULL, blank=True, null=True, related_name='products')
+
+    objects = ProductQuerySet.as_manager()
 
-    # Override the save method to generate a unique SKU SKu is a mix of the first 3 letters of the product name and 3 numbers derived from the reference and 4 numbers derived from 
+    # SKUs are the first 3 letters or digits of the name and a per-prefix
+    # counter, e.g. OIL-0042. Older SKUs have no dash, but a hand-entered SKU
+    # can still look like a generated one, so assign_skus() skips those.
     def save(self, *args, **kwargs):
         if not self.SKU:
-            sku_prefix = self.name[:3].upper()
-            ref_numbers = ''.join(filter(str.isdigit, self.reference))[-3:]
-            rand_numbers = str(uuid.uuid4().int)[:4]
-            self.SKU = f"{sku_prefix}{ref_numbers}{rand_numbers}"
-        super().save(*args, **kwargs)    
-    
+            Product.assign_skus([self])
+        super().save(*args, **kwargs)
+
+    @property
+    def sku_stem(self):
+        return re.sub(r'[^A-Z0-9]', '', self.name.upper())[:3] or 'PRD'
+
+    @classmethod
+    def assign_skus(cls, products):
+        """
+        Give every product without a SKU a new one; used by bulk inserts,
+        which bypass save(). Numbers whose SKU is already taken are skipped
+        and more are reserved in their place.
+        """
+        pending = defaultdict(list)
+        for product in products:
+            if not product.SKU:
+                pending[product.sku_stem].append(product)
+        while pending:
+            blocks = Sequence.objects.reserve({f'sku:{stem}': len(stem_products) for stem, stem_products in pending.items()})
+            candidates = {
+                f'{stem}-{number:04d}': product
+                for stem, stem_products in pending.items()
+                for product, number in zip(stem_products, blocks[f'sku:{stem}'])
+            }
+            taken = set(cls.objects.filter(SKU__in=candidates).values_list('SKU', flat=True))
+            pending = defaultdict(list)
+            for sku, product in candidates.items():
+                if sku in taken:
+                    pending[product.sku_stem].append(product)
+                else:
+                    product.SKU = sku
+
     def __str__(self):
         return self.name + ' - ' + self.SKU
 
+    class Meta:
+        indexes = [
+            # Serves the low-stock query: stock_margin <= 0 ordered by urgency
+            models.Index(models.F('current_quantity') - models.F('low_quantity'), models.F('id'), name='product_stock_margin_idx'),
+        ]
+
 # make model for supplier
 class Supplier(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
     email = models.EmailField(max_length=254, blank=True, null=True)
     address = models.CharField(max_length=100, blank=True, null=True)
@@ -67,6 +159,33 @@ class Supplier(models.Model):
 
 
 
+class OrderQuerySet(models.QuerySet):
+    @staticmethod
+    def items_prefetch():
+        items = OrderItem.objects.select_related('product').order_by('id')
+        return models.Prefetch('orderitem_set', queryset=items)
+
+    def with_items(self):
+        # Load every order's line items and their products in one extra query
+        return self.prefetch_related(self.items_prefetch())
+
+    def update_totals(self):
+        # Recompute total_price from the line items with a single UPDATE
+        line_totals = (
+            OrderItem.objects.filter(Order=models.OuterRef('pk'))
+            .values('Order')
+            .annotate(total=models.Sum(
+                models.F('quantity') * models.F('product__unit_price'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ))
+            .values('total')
+        )
+        return self.update(total_price=Coalesce(
+            models.Subquery(line_totals), models.Value(Decimal('0.00')),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        ))
+
+
 class Order(models.Model):
     order_number = models.CharField(max_length=50, unique=True, editable=False)
     products = models.ManyToManyField(Product, through='OrderItem')
@@ -84,6 +203,15 @@ class Order(models.Model):
     # delivery_order_number must be unique and to be updated one status_choices is changed to completed
     delivery_order_number = models.CharField(max_length=50, unique=True, blank=True, null=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the post_save signal spot the delivery of the order
+        instance._loaded_is_delivered = instance.__dict__.get('is_delivered')
+        return instance
+
     def clean(self):
         super().clean()
         if self.status == 'C' and self.delivery_order_number:
@@ -97,28 +225,62 @@ class Order(models.Model):
                     {'delivery_order_number': 'Delivery order number must be unique.'}
                 )
 
-    def save(self, *args, **kwargs):
-        if not self.order_number:
-            self.order_number = str(uuid.uuid4())[:8].upper()
+    def assign_numbers(self):
+        Order.assign_numbers_to([self])
 
-        if self.is_delivered and self.status != 'C':
-            self.status = 'C'
-            self.delivery_order_number = str(uuid.uuid4())[:8].upper()
+    @classmethod
+    def assign_numbers_to(cls, orders):
+        """Number new orders and complete delivered ones; used by bulk inserts, which bypass save()."""
+        from .numbers import allocate  # numbers imports the models
 
-        # Calculate the total price of the order based on the products in the order
-        super().save(*args, **kwargs)
-        self.total_price = sum([item.product.unit_price * item.quantity for item in self.orderitem_set.all()])
+        unnumbered = [order for order in orders if not order.order_number]
+        for order, number in zip(unnumbered, allocate('order', len(unnumbered))):
+            order.order_number = number
+
+        delivered = [order for order in orders if order.is_delivered and order.status != 'C']
+        for order, number in zip(delivered, allocate('delivery', len(delivered))):
+            order.status = 'C'
+            order.delivery_order_number = number
+
+    def save(self, *args, **kwargs):
+        self.assign_numbers()
+
+        # total_price is maintained by the OrderItem signals (see update_totals),
+        # so an update never writes back a possibly stale in-memory total.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'total_price'
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.order_number
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_ordered', 'id'], name='order_date_ordered_id_idx'),
+            # Covers the dashboard's spend per supplier of pending orders
+            models.Index(fields=['status', 'supplier', 'total_price'], name='order_status_supplier_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     Order = models.ForeignKey('Order', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded order so a reassigned item also refreshes it
+        instance._loaded_order_id = instance.__dict__.get('Order_id')
+        return instance
+
+    @property
+    def line_total(self):
+        return self.product.unit_price * self.quantity
+
     def __str__(self):
         return self.product.name
 
@@ -155,7 +317,7 @@ class Vehicle(models.Model):
 
 # Driver class model to store the driver information and the vehicle he drives
 class Driver(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
     driving_license = models.CharField(max_length=50, blank=True, null=True)
 
@@ -168,6 +330,26 @@ class LatestReparationProductManager(models.Manager):
         return self.filter(vehicle=vehicle).order_by('-date_created').first()
 
 
+class ReparationProductQuerySet(models.QuerySet):
+    def update_totals(self):
+        # Recompute total_price from the line items with a single UPDATE
+        line_totals = (
+            ReparationProductItem.objects.filter(reparation_product=models.OuterRef('pk'))
+            .values('reparation_product')
+            .annotate(total=models.Sum(
+                models.F('quantity') * models.F('product__unit_price'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ))
+            .values('total')
+        )
+        updated = self.update(total_price=Coalesce(
+            models.Subquery(line_totals), models.Value(Decimal('0.00')),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        ))
+        VehicleCostRollup.objects.refresh(VehicleCostRollup.buckets_of(self))
+        return updated
+
+
 # generate comment for the class model below
 class ReparationProduct(models.Model):
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE)
@@ -178,16 +360,38 @@ class ReparationProduct(models.Model):
     driver = models.ForeignKey(Driver, on_delete=models.CASCADE, default="Driver not assigned")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
-    def save(self, *args, **kwargs):
-        # Recalculate the total price based on the product quantities
-        self.total_price = sum(item.product.unit_price * item.quantity for item in self.reparationproductitem_set.all())
-        super().save(*args, **kwargs)
+    objects = ReparationProductQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the post_save signal refresh the cost rollup the reparation leaves
+        instance._loaded_rollup = (instance.__dict__.get('vehicle_id'), instance.__dict__.get('odometer'))
+        return instance
+
+    @property
+    def rollup_bucket(self):
+        return (self.vehicle_id, VehicleCostRollup.period_of(self.date_repaired))
+
+    def recalculate_total(self):
+        # One aggregate over the items and one UPDATE, without calling save()
+        total = self.reparationproductitem_set.aggregate(total=models.Sum(
+            models.F('quantity') * models.F('product__unit_price'),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        ))['total'] or Decimal('0.00')
+        ReparationProduct.objects.filter(pk=self.pk).update(total_price=total)
+        self.total_price = total
+        VehicleCostRollup.objects.refresh([self.rollup_bucket])
+        return total
 
     def __str__(self):
         return f'{self.vehicle} ({self.date_repaired})'
 
     class Meta:
         unique_together = ('vehicle', 'date_repaired')
+        indexes = [
+            models.Index(fields=['date_repaired', 'id'], name='reparation_date_id_idx'),
+        ]
 
 
 class ReparationProductItem(models.Model):
@@ -195,6 +399,13 @@ class ReparationProductItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the signals work out the stock consumed by an edit
+        instance._loaded_line = (instance.__dict__.get('product_id'), instance.__dict__.get('quantity'))
+        return instance
+
     def __str__(self):
         return f'{self.product} ({self.quantity})'
 
@@ -207,7 +418,8 @@ class ReparationInvoice(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.invoice_number:
-            self.invoice_number = str(uuid.uuid4())[:8].upper()
+            from .numbers import allocate  # numbers imports the models
+            self.invoice_number, = allocate('reparation_invoice')
         self.total_price = self.reparation.total_price
         super().save(*args, **kwargs)
 
@@ -215,55 +427,161 @@ class ReparationInvoice(models.Model):
         return self.invoice_number
 
 
-# make a class for knowing a current quantity of product in the stock by passing the product name and reference
-class Stock(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+class VehicleCostRollupQuerySet(models.QuerySet):
+    def refresh(self, buckets):
+        """
+        Recompute the given (vehicle id, period) buckets from their
+        reparations: one grouped read, one upsert and one delete for
+        buckets that no longer have any reparation.
+        """
+        buckets = set(buckets)
+        if not buckets:
+            return
+        condition = models.Q()
+        for vehicle_id, period in buckets:
+            start, end = VehicleCostRollup.period_bounds(period)
+            condition |= models.Q(vehicle_id=vehicle_id, date_repaired__gte=start, date_repaired__lt=end)
+        rows = [
+            VehicleCostRollup(**values)
+            for values in VehicleCostRollup.aggregate_reparations(ReparationProduct.objects.filter(condition))
+        ]
+        self.bulk_create(
+            rows, update_conflicts=True, unique_fields=['vehicle', 'period'],
+            update_fields=['total_cost', 'reparations', 'min_odometer', 'max_odometer'],
+        )
+        empty = buckets - {(row.vehicle_id, row.period) for row in rows}
+        if empty:
+            self.filter(models.Q(*[
+                models.Q(vehicle_id=vehicle_id, period=period) for vehicle_id, period in empty
+            ], _connector=models.Q.OR)).delete()
+
+    def rebuild(self):
+        """Replace every rollup with one recomputed from all reparations."""
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            self.all().delete()
+            rows = self.bulk_create(
+                [VehicleCostRollup(**values) for values in VehicleCostRollup.aggregate_reparations(ReparationProduct.objects.all())],
+                batch_size=500,
+            )
+        return len(rows)
+
+
+# Reparation costs per vehicle and calendar month, kept up to date as
+# reparations change so fleet reports never scan the reparations themselves.
+class VehicleCostRollup(models.Model):
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='cost_rollups')
+    # First day of the month
+    period = models.DateField()
+    total_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    reparations = models.IntegerField(default=0)
+    # Lowest and highest odometer reading of the period, for cost per km
+    min_odometer = models.IntegerField(blank=True, null=True)
+    max_odometer = models.IntegerField(blank=True, null=True)
+
+    objects = VehicleCostRollupQuerySet.as_manager()
+
+    @staticmethod
+    def period_of(moment):
+        return timezone.localtime(moment).date().replace(day=1)
+
+    @staticmethod
+    def period_bounds(period):
+        start = timezone.make_aware(dt.datetime.combine(period, dt.time()))
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        return start, end
+
+    @classmethod
+    def buckets_of(cls, reparations):
+        return {
+            (vehicle_id, cls.period_of(date_repaired))
+            for vehicle_id, date_repaired in reparations.order_by().values_list('vehicle_id', 'date_repaired')
+        }
+
+    @staticmethod
+    def aggregate_reparations(reparations):
+        return (
+            reparations.order_by()
+            .annotate(period=TruncMonth('date_repaired', output_field=models.DateField()))
+            .values('vehicle_id', 'period')
+            .annotate(
+                total_cost=Coalesce(models.Sum('total_price'), models.Value(Decimal('0.00')),
+                                    output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+                reparations=models.Count('id'),
+                min_odometer=models.Min('odometer'),
+                max_odometer=models.Max('odometer'),
+            )
+        )
+
+    def __str__(self):
+        return f'{self.vehicle} {self.period:%Y-%m}: {self.total_cost}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vehicle', 'period'], name='rollup_vehicle_period_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'vehicle'], name='rollup_period_vehicle_idx'),
+        ]
+
+
+# Append-only ledger of stock changes. Product.current_quantity is the running
+# sum of a product's movements; see inventory/stock.py for how they are written.
+class StockMovement(models.Model):
+    kind_choices = (
+        ('R', 'RECEIPT'),
+        ('C', 'CONSUMPTION'),
+        ('A', 'ADJUSTMENT'),
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=1, choices=kind_choices)
+    # Signed change in items, negative when stock leaves the warehouse
     quantity = models.IntegerField()
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, blank=True, null=True)
+    reparation_product = models.ForeignKey(ReparationProduct, on_delete=models.SET_NULL, blank=True, null=True)
+    note = models.CharField(max_length=200, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Stock movements are append-only.')
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return self.product.name
+        return f'{self.get_kind_display()} {self.quantity:+d} {self.product.name}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'date_created'], name='movement_product_date_idx'),
+        ]
+        constraints = [
+            # An order is received once, see stock.receive_order()
+            models.UniqueConstraint(
+                fields=['order', 'product'], condition=models.Q(kind='R'), name='movement_one_receipt_per_order_product',
+            ),
+        ]
+
+# Output of the forecast_stock command (see inventory/forecast.py), replaced
+# as a whole on every run.
+class ProductForecast(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    # Stock when the forecast was computed
+    current_quantity = models.IntegerField()
+    # Items consumed per week: mean of the last weeks, and exponentially smoothed
+    weekly_average = models.FloatField()
+    smoothed_weekly = models.FloatField()
+    daily_rate = models.FloatField()
+    # Empty when nothing is being consumed
+    days_of_cover = models.FloatField(blank=True, null=True)
+    stockout_date = models.DateField(blank=True, null=True)
+    computed_at = models.DateTimeField()
 
-    # FUNCTION the product to be added to the stock and the quantity to be updated but it is not working
-    def add_product_to_stock(self, product, quantity):
-        stock = self.get_stock_for_product(product)
-        stock.quantity += quantity
-        stock.save()
-
-    def get_stock_for_product(self, product):
-        return self.filter(product=product).first()
-    
-    # FUNCTION the product to be removed from the stock and the quantity to be updated but it is not working
-    def remove_product_from_stock(self, product, quantity):
-        stock = self.get_stock_for_product(product)
-        stock.quantity -= quantity
-        stock.save()
-
-    def get_stock_for_product(self, product):
-        return self.filter(product=product).first()
-
-    # FUNCTION to update the stock when a product is added to the stock
-    def update_stock(self, product, quantity):
-        stock = self.get_stock_for_product(product)
-        stock.quantity += quantity
-        stock.save()
-
-    
-        # run those fuctions in the admin.py file to update the stock when a product is added to the stock
-        def save_model(self, request, obj, form, change):
-            super().save_model(request, obj, form, change)
-            if change:
-                self.update_stock(obj.product, obj.quantity)
-
-        def update_stock(self, product, quantity):
-
-            stock = Stock.objects.get_stock_for_product(product)
-            stock.quantity += quantity
-            stock.save()
-        
-        @classmethod
-        def get_stock_for_product(cls, product):
-            stock, created = cls.objects.get_or_create(product=product)
-            return stock
+    def __str__(self):
+        return f'{self.product}: {self.days_of_cover} days'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['days_of_cover', 'product'], name='forecast_cover_idx'),
+        ]
 
 # def generate_delivery_order_number():
 #     return str(uuid.uuid4())[:8].upper()
@@ -0,0 +1,66 @@
+import string
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .models import Sequence
+
+# Document numbers come from one Sequence per kind. Each process reserves
+# them in blocks, so numbers are unique but not contiguous: a block that is
+# not used up before the process exits leaves a gap. Blocks are only
+# reserved outside transactions, i.e. by bare save() calls. Inside one (the
+# API serializers, reorder(), import chunks) what is left of the block is
+# used first, then each allocate() call reserves exactly what it still
+# needs, in one round trip whatever `count`. Reserving blocks on a
+# connection of their own would not help on SQLite: the caller's
+# transaction already holds the only write lock.
+DEFAULT_FORMATS = {
+    'order': 'PO-{number:06d}',
+    'delivery': 'DO-{number:06d}',
+    'invoice': 'INV-{number:06d}',
+    'reparation_invoice': 'RI-{number:06d}',
+}
+
+
+def number_format(kind):
+    """The format of `kind`, settings.DOCUMENT_NUMBER_FORMATS overriding the defaults."""
+    template = {**DEFAULT_FORMATS, **getattr(settings, 'DOCUMENT_NUMBER_FORMATS', {})}[kind]
+    if 'number' not in {field for _, field, _, _ in string.Formatter().parse(template)}:
+        raise ImproperlyConfigured(f"DOCUMENT_NUMBER_FORMATS['{kind}'] must contain {{number}}.")
+    return template
+
+
+def block_size():
+    return getattr(settings, 'DOCUMENT_NUMBER_BLOCK_SIZE', 100)
+
+_blocks = defaultdict(deque)
+_lock = threading.Lock()
+
+
+def sequence_name(kind):
+    return f'document:{kind}'
+
+
+def allocate(kind, count=1):
+    """Return `count` new formatted numbers for documents of `kind`."""
+    template = number_format(kind)
+    with _lock:
+        block = _blocks[kind]
+        numbers = [block.popleft() for _ in range(min(count, len(block)))]
+
+    shortfall = count - len(numbers)
+    if shortfall:
+        name = sequence_name(kind)
+        if transaction.get_connection().in_atomic_block:
+            # A rollback would hand the same values out again, so take no
+            # more than the caller's transaction is going to use
+            numbers.extend(Sequence.objects.reserve({name: shortfall})[name])
+        else:
+            reserved = Sequence.objects.reserve({name: max(shortfall, block_size())})[name]
+            numbers.extend(reserved[:shortfall])
+            with _lock:
+                _blocks[kind].extend(reserved[shortfall:])
+    return [template.format(number=number) for number in numbers]
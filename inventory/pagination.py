@@ -0,0 +1,183 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from urllib import parse
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import IntegerField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination that seeks on the ordering columns instead of
+    using OFFSET, so the cost of a page does not grow with its depth.
+
+    `ordering` must end with a unique column (normally the primary key) and
+    should be backed by an index, e.g. ('-date_ordered', '-id').
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = None  # settings.PAGINATION_MAX_PAGE_SIZE
+    ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_results(list(self.get_page_queryset(queryset, request)))
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Return the (unevaluated) queryset for the requested page. It fetches
+        one extra row so we know whether another page follows.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.position, self.reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [_invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.seek_filter(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def paginate_results(self, results):
+        has_extra = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_extra
+        else:
+            self.has_next = has_extra
+            self.has_previous = self.position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size or getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 500))
+
+    def seek_filter(self, ordering, position):
+        # (a, b) < (x, y) is written as a < x OR (a = x AND b < y) so that it
+        # works on every backend and each column keeps its own direction.
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            branch = Q(**{f'{name}__{lookup}': position[index]})
+            for previous, value in zip(ordering[:index], position[:index]):
+                branch &= Q(**{previous.lstrip('-'): value})
+            condition |= branch
+        return condition
+
+    def get_position(self, instance):
+        return [self._field_to_string(field.lstrip('-'), instance) for field in self.ordering]
+
+    def encode_cursor(self, instance, reverse):
+        payload = {'p': self.get_position(instance)}
+        if reverse:
+            payload['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('ascii'))
+        return replace_query_param(self.base_url, self.cursor_query_param, token.decode('ascii'))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(parse.unquote(encoded).encode('ascii')))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            position = [
+                self._field_to_python(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, binascii.Error, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(payload.get('r'))
+
+    def _field_to_string(self, name, instance):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations are encoded as plain JSON values.
+            return getattr(instance, name)
+        return field.value_to_string(instance)
+
+    def _field_to_python(self, name, value):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # The annotations paginated on are integer expressions
+            field = IntegerField()
+        value = field.to_python(value)
+        if value is None:
+            # The ordering columns are never NULL, and filtering on None fails
+            raise ValueError
+        return value
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OrderKeysetPagination(KeysetPagination):
+    ordering = ('-date_ordered', '-id')
+
+
+class ReparationKeysetPagination(KeysetPagination):
+    ordering = ('-date_repaired', '-id')
+
+
+class LowStockKeysetPagination(KeysetPagination):
+    ordering = ('stock_margin', 'id')
+
+
+class ForecastKeysetPagination(KeysetPagination):
+    ordering = ('days_of_cover', 'product')
+
+
+def _invert(field):
+    return field[1:] if field.startswith('-') else '-' + field
@@ -0,0 +1,76 @@
+from collections import namedtuple
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .bulk import create_orders
+from .models import Product, Order, OrderItem
+
+ReorderLine = namedtuple('ReorderLine', ['product', 'shortfall', 'units'])
+
+
+def plan_reorders():
+    """
+    Work out what to order for every product below min_quantity, in one
+    query. Items already on pending orders count towards the stock, and
+    the order brings the product back up to its low_quantity (or
+    min_quantity if that is higher), rounded up to whole units.
+
+    Returns (lines, unassigned): lines sorted by supplier, and the products
+    that need reordering but have no preferred supplier.
+    """
+    on_order = (
+        OrderItem.objects.filter(product=OuterRef('pk'), Order__status='P')
+        .values('product')
+        .annotate(items=Sum(F('quantity') * F('product__items_per_unit')))
+        .values('items')
+    )
+    products = (
+        Product.objects.filter(current_quantity__lt=F('min_quantity'))
+        .annotate(
+            on_order=Coalesce(Subquery(on_order, output_field=IntegerField()), Value(0)),
+            shortfall=Greatest('low_quantity', 'min_quantity') - F('current_quantity') - F('on_order'),
+        )
+        .filter(shortfall__gt=0)
+        .select_related('supplier')
+        .order_by('supplier_id', 'id')
+    )
+
+    lines, unassigned = [], []
+    for product in products:
+        if product.supplier_id is None:
+            unassigned.append(product)
+            continue
+        per_unit = max(product.items_per_unit, 1)
+        units = -(-product.shortfall // per_unit)
+        lines.append(ReorderLine(product, product.shortfall, units))
+    return lines, unassigned
+
+
+def create_reorders(lines):
+    """Create one pending order per supplier for the planned lines."""
+    documents = [
+        (
+            Order(supplier_id=supplier_id, status='P'),
+            [OrderItem(product=line.product, quantity=line.units) for line in supplier_lines],
+        )
+        for supplier_id, supplier_lines in groupby(lines, key=lambda line: line.product.supplier_id)
+    ]
+    if not documents:
+        return []
+    with transaction.atomic():
+        return create_orders(documents)
+
+
+def reorder():
+    """
+    Plan and create the orders in one transaction. With IMMEDIATE
+    transactions (see settings.DATABASES) it takes the write lock before
+    planning, so concurrent runs are serialized and the second one sees
+    the first one's pending orders instead of ordering the same shortfall.
+    """
+    with transaction.atomic():
+        lines, unassigned = plan_reorders()
+        return create_reorders(lines), unassigned
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# A read-only connection to the same data: a second connection to the SQLite
+# file with query_only set, or a snapshot copy. Reads go there only while
+# replica reads are enabled, e.g. by ReplicaReadMiddleware for safe requests.
+REPLICA_ALIAS = getattr(settings, 'REPLICA_DATABASE_ALIAS', 'replica')
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def _reads(enabled):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads():
+    """Send the reads of the enclosed block to the replica (report jobs, exports)."""
+    return _reads(True)
+
+
+def primary_reads():
+    """Keep the reads of the enclosed block on the primary."""
+    return _reads(False)
+
+
+def reading_from_replica():
+    return _replica_reads.get() and REPLICA_ALIAS in connections.settings
+
+
+class ReplicaRouter:
+    """
+    Writes always go to the primary. Reads go to the replica when enabled,
+    except inside a transaction on the primary: those must see the
+    transaction's own writes and the snapshot it has taken.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
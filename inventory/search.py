@@ -0,0 +1,50 @@
+import re
+from functools import reduce
+from operator import and_
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+# On SQLite, products are indexed in an FTS5 table that reads its content
+# from inventory_product (external content) and is kept in sync by
+# triggers, so every write path, bulk ones included, updates it. They are
+# created by migration 0010. Any later migration that rebuilds
+# inventory_product (most AlterFields on SQLite) drops the triggers and has
+# to recreate them, as 0011 does; ProductSearchTests checks they survive.
+FTS_TABLE = 'inventory_product_fts'
+
+# Relative bm25 weights of name, reference and SKU
+FTS_WEIGHTS = (1.0, 4.0, 4.0)
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query)
+
+
+def search_products(query, limit=20):
+    """
+    Products matching every term of `query` as a prefix of a word in their
+    name, reference or SKU, best matches first.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if connection.vendor != 'sqlite':
+        return list(_search_like(terms)[:limit])
+    # Quoted so terms are never read as FTS operators; * makes them prefixes
+    match = ' '.join(f'"{term}"*' for term in terms)
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    return list(Product.objects.raw(
+        f'SELECT p.* FROM {FTS_TABLE} f JOIN inventory_product p ON p.id = f.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}, {weights}), p.id LIMIT %s',
+        [match, limit],
+    ))
+
+
+def _search_like(terms):
+    return Product.objects.filter(reduce(and_, [
+        Q(name__icontains=term) | Q(reference__icontains=term) | Q(SKU__icontains=term)
+        for term in terms
+    ])).order_by('name', 'id')
@@ -1,5 +1,13 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
-from .models import Product, Supplier, Order, OrderItem, Invoice, Vehicle, Driver, ReparationProduct, ReparationInvoice, ReparationProductItem
+from .models import Product, Supplier, Order, OrderItem, Invoice, Vehicle, Driver, ReparationProduct, ReparationInvoice, ReparationProductItem, StockMovement, ProductForecast
+from .signals import bulk_item_changes
+from . import stock
+from .cache import invalidate
 
 
 
@@ -9,6 +17,59 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'SKU', 'name', 'reference', 'unit_price', 'items_per_unit','current_quantity']
 
 
+class LowStockProductSerializer(serializers.ModelSerializer):
+    stock_margin = serializers.IntegerField(read_only=True)
+    level = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'SKU', 'name', 'reference', 'current_quantity', 'low_quantity', 'min_quantity', 'stock_margin', 'level']
+
+    def get_level(self, obj):
+        return 'critical' if obj.current_quantity <= obj.min_quantity else 'low'
+
+
+class BulkProductListSerializer(serializers.ListSerializer):
+    """
+    Fetches the products of every line with a single query before the
+    lines are validated, instead of one lookup per line.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = set()
+            for line in data:
+                try:
+                    ids.add(int(line['product']))
+                except (TypeError, ValueError, KeyError):
+                    continue
+            self.products = Product.objects.in_bulk(ids)
+        return super().to_internal_value(data)
+
+
+class LineProductField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        products = getattr(self.parent.parent, 'products', None)
+        if products is None:
+            return super().to_internal_value(data)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in products:
+            self.fail('does_not_exist', pk_value=data)
+        return products[pk]
+
+
+class ProductForecastSerializer(serializers.ModelSerializer):
+    reference = serializers.CharField(source='product.reference', read_only=True)
+    name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = ProductForecast
+        fields = ['product', 'reference', 'name', 'current_quantity', 'weekly_average', 'smoothed_weekly',
+                  'daily_rate', 'days_of_cover', 'stockout_date', 'computed_at']
+
+
 class SupplierSerializer(serializers.ModelSerializer):
     class Meta:
         model = Supplier
@@ -20,6 +81,7 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'order_number', 'date_ordered', 'date_delivered', 'is_delivered', 'total_price', 'status', 'delivery_order_number', 'supplier', 'products']
+        read_only_fields = ['total_price']
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -27,6 +89,34 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = '__all__'
 
+
+class OrderItemWriteSerializer(serializers.ModelSerializer):
+    product = LineProductField(queryset=Product.objects.all())
+
+    class Meta:
+        model = OrderItem
+        fields = ['product', 'quantity']
+        list_serializer_class = BulkProductListSerializer
+
+
+class OrderItemReadSerializer(serializers.ModelSerializer):
+    product = ProductSerializer(read_only=True)
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'quantity', 'line_total']
+
+
+# Read representation of an order with its line items. Querysets must come
+# from Order.objects.with_items() so the items are not fetched per order.
+class OrderReadSerializer(serializers.ModelSerializer):
+    items = OrderItemReadSerializer(source='orderitem_set', many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'order_number', 'date_ordered', 'date_delivered', 'is_delivered', 'total_price', 'status', 'delivery_order_number', 'supplier', 'items']
+
 class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
@@ -46,63 +136,290 @@ class DriverSerializer(serializers.ModelSerializer):
 
 # serializers.py
 class ReparationProductItemSerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True, read_only=True)
+    product = LineProductField(queryset=Product.objects.all())
 
     class Meta:
-        model = Product
-        fields = '__all__'
+        model = ReparationProductItem
+        fields = ['id', 'product', 'quantity']
+        list_serializer_class = BulkProductListSerializer
 
 
-class ReparationProductListCreateSerializer(serializers.ModelSerializer):
-    products = ReparationProductItemSerializer(many=True)
+class ReparationItemsMixin:
+    """
+    Writes the nested reparation lines. Updates are applied as a diff
+    against the stored lines, so unchanged rows are left alone.
+    """
 
-    class Meta:
-        model = ReparationProduct
-        fields = ['id', 'vehicle', 'odometer', 'products', 'date_repaired', 'location', 'driver', 'total_price']
-    
     def create(self, validated_data):
-        products_data = validated_data.pop('products')
-        reparation_product = ReparationProduct.objects.create(**validated_data)
-        for product_data in products_data:
-            ReparationProductItem.objects.create(reparation_product=reparation_product, **product_data)
+        products_data = validated_data.pop('reparationproductitem_set')
+        with transaction.atomic():
+            reparation_product = ReparationProduct.objects.create(**validated_data)
+            items = ReparationProductItem.objects.bulk_create([
+                ReparationProductItem(reparation_product=reparation_product, **product_data)
+                for product_data in products_data
+            ])
+            reparation_product.recalculate_total()
+            used = defaultdict(int)
+            for item in items:
+                used[item.product_id] += item.quantity
+            stock.consume(reparation_product, used)
         return reparation_product
 
     def update(self, instance, validated_data):
-        products_data = validated_data.pop('products')
+        products_data = validated_data.pop('reparationproductitem_set', None)
         instance.vehicle = validated_data.get('vehicle', instance.vehicle)
         instance.odometer = validated_data.get('odometer', instance.odometer)
         instance.date_repaired = validated_data.get('date_repaired', instance.date_repaired)
         instance.location = validated_data.get('location', instance.location)
         instance.driver = validated_data.get('driver', instance.driver)
-        instance.save()
-        product_items = instance.reparationproductitem_set.all()
-        product_items.delete()
-        for product_data in products_data:
-            ReparationProductItem.objects.create(reparation_product=instance, **product_data)
-        instance.refresh_from_db()
+        with transaction.atomic():
+            instance.save()
+            if products_data is not None:
+                self.sync_items(instance, products_data)
+                instance.recalculate_total()
         return instance
 
+    def sync_items(self, instance, products_data):
+        # Lines are matched on product; repeated products are merged
+        wanted = {}
+        for product_data in products_data:
+            product_id = product_data['product'].pk
+            wanted[product_id] = wanted.get(product_id, 0) + product_data['quantity']
+
+        existing = {}
+        removed = []
+        # Change in parts used per product, applied to the stock ledger
+        used = defaultdict(int, wanted)
+        for item in instance.reparationproductitem_set.all():
+            used[item.product_id] -= item.quantity
+            if item.product_id in existing or item.product_id not in wanted:
+                removed.append(item.pk)
+            else:
+                existing[item.product_id] = item
 
+        changed = []
+        for product_id, item in existing.items():
+            if item.quantity != wanted[product_id]:
+                item.quantity = wanted[product_id]
+                changed.append(item)
+        added = [
+            ReparationProductItem(reparation_product=instance, product_id=product_id, quantity=quantity)
+            for product_id, quantity in wanted.items() if product_id not in existing
+        ]
 
-class ReparationProductRetrieveUpdateDestroySerializer(serializers.ModelSerializer):
-    products = ReparationProductItemSerializer(many=True)
+        with bulk_item_changes():
+            if removed:
+                ReparationProductItem.objects.filter(pk__in=removed).delete()
+        if changed:
+            ReparationProductItem.objects.bulk_update(changed, ['quantity'])
+        if added:
+            ReparationProductItem.objects.bulk_create(added)
+        stock.consume(instance, used)
+
+
+class ReparationProductListCreateSerializer(ReparationItemsMixin, serializers.ModelSerializer):
+    products = ReparationProductItemSerializer(many=True, source='reparationproductitem_set')
 
     class Meta:
         model = ReparationProduct
         fields = ['id', 'vehicle', 'odometer', 'products', 'date_repaired', 'location', 'driver', 'total_price']
         read_only_fields = ['id', 'total_price']
 
-    def update(self, instance, validated_data):
-        products_data = validated_data.pop('products')
-        instance.vehicle = validated_data.get('vehicle', instance.vehicle)
-        instance.odometer = validated_data.get('odometer', instance.odometer)
-        instance.date_repaired = validated_data.get('date_repaired', instance.date_repaired)
-        instance.location = validated_data.get('location', instance.location)
-        instance.driver = validated_data.get('driver', instance.driver)
-        instance.save()
-        product_items = instance.reparationproductitem_set.all()
-        product_items.delete()
-        for product_data in products_data:
-            ReparationProductItem.objects.create(reparation_product=instance, **product_data)
-        instance.refresh_from_db()
-        return instance
\ No newline at end of file
+
+class ReparationProductRetrieveUpdateDestroySerializer(ReparationItemsMixin, serializers.ModelSerializer):
+    products = ReparationProductItemSerializer(many=True, source='reparationproductitem_set')
+
+    class Meta:
+        model = ReparationProduct
+        fields = ['id', 'vehicle', 'odometer', 'products', 'date_repaired', 'location', 'driver', 'total_price']
+        read_only_fields = ['id', 'total_price']
+
+
+class OrderWithItemsCreateSerializer(serializers.ModelSerializer):
+    items = OrderItemWriteSerializer(many=True, source='orderitem_set', allow_empty=False)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'order_number', 'supplier', 'status', 'is_delivered', 'delivery_order_number', 'items']
+        read_only_fields = ['id', 'order_number']
+
+    def create(self, validated_data):
+        items_data = validated_data.pop('orderitem_set')
+        order = Order(**validated_data)
+        # The products are already loaded, so the total is known before the
+        # order is written and the invoice from the post_save signal is final.
+        order.total_price = sum(item['product'].unit_price * item['quantity'] for item in items_data)
+        with transaction.atomic():
+            order.save()
+            OrderItem.objects.bulk_create([OrderItem(Order=order, **item) for item in items_data])
+        return order
+
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], Order.objects.items_prefetch())
+        return OrderReadSerializer(instance, context=self.context).data
+
+
+class BulkUpsertListSerializer(serializers.ListSerializer):
+    """
+    Inserts or updates a batch of rows matched on the child's
+    Meta.natural_key. Existing rows are resolved in one query per chunk,
+    and only rows whose values actually changed are written back.
+    """
+    batch_size = 500
+
+    def validate(self, attrs):
+        key = self.child.Meta.natural_key
+        seen, duplicates = set(), set()
+        for row in attrs:
+            if row[key] in seen:
+                duplicates.add(row[key])
+            seen.add(row[key])
+        if duplicates:
+            raise serializers.ValidationError(
+                f"Duplicate {key} values in batch: {', '.join(sorted(map(str, duplicates)))}"
+            )
+        return attrs
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        key = self.child.Meta.natural_key
+        keys = [row[key] for row in validated_data]
+
+        existing = {}
+        for start in range(0, len(keys), self.batch_size):
+            chunk = model.objects.filter(**{f'{key}__in': keys[start:start + self.batch_size]})
+            # On non-unique keys the oldest row wins
+            for instance in chunk.order_by('-pk'):
+                existing[getattr(instance, key)] = instance
+
+        created, updated, update_fields = [], [], set()
+        for row in validated_data:
+            instance = existing.get(row[key])
+            if instance is None:
+                created.append(self.child.build_instance(row))
+                continue
+            changed = [name for name, value in row.items() if getattr(instance, name) != value]
+            if changed:
+                for name in changed:
+                    setattr(instance, name, row[name])
+                update_fields.update(changed)
+                updated.append(instance)
+
+        with transaction.atomic():
+            self.child.prepare_created(created)
+            model.objects.bulk_create(created, batch_size=self.batch_size)
+            if updated:
+                model.objects.bulk_update(updated, sorted(update_fields), batch_size=self.batch_size)
+        invalidate(model)
+
+        self.counts = {
+            'created': len(created),
+            'updated': len(updated),
+            'unchanged': len(validated_data) - len(created) - len(updated),
+        }
+        return created + updated
+
+
+class UpsertSerializer(serializers.ModelSerializer):
+    def build_instance(self, validated_data):
+        return self.Meta.model(**validated_data)
+
+    def prepare_created(self, instances):
+        # Fill in what save() would, for the new rows of a batch
+        pass
+
+
+class ProductUpsertSerializer(UpsertSerializer):
+    class Meta:
+        model = Product
+        fields = ['name', 'reference', 'unit_price', 'items_per_unit', 'min_quantity', 'low_quantity']
+        natural_key = 'reference'
+        extra_kwargs = {'reference': {'validators': []}}
+        list_serializer_class = BulkUpsertListSerializer
+
+    def prepare_created(self, instances):
+        # bulk_create skips Product.save(), so assign the SKUs here
+        Product.assign_skus(instances)
+
+
+class SupplierUpsertSerializer(UpsertSerializer):
+    class Meta:
+        model = Supplier
+        fields = ['name', 'phone', 'email', 'address', 'city', 'country']
+        natural_key = 'name'
+        list_serializer_class = BulkUpsertListSerializer
+
+
+class VehicleUpsertSerializer(UpsertSerializer):
+    class Meta:
+        model = Vehicle
+        fields = ['name', 'code', 'license_plate', 'brand', 'model', 'year', 'chassis_number', 'engine_model']
+        natural_key = 'license_plate'
+        extra_kwargs = {'license_plate': {'validators': [], 'required': True, 'allow_null': False}}
+        list_serializer_class = BulkUpsertListSerializer
+
+
+class DriverUpsertSerializer(UpsertSerializer):
+    class Meta:
+        model = Driver
+        fields = ['name', 'phone', 'driving_license']
+        natural_key = 'name'
+        list_serializer_class = BulkUpsertListSerializer
+
+
+# Movements are created as manual adjustments; receipts and consumption
+# are recorded by the order and reparation code paths.
+class StockMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'product', 'kind', 'quantity', 'order', 'reparation_product', 'note', 'date_created']
+        read_only_fields = ['id', 'kind', 'order', 'reparation_product', 'date_created']
+
+    def validate_quantity(self, value):
+        if value == 0:
+            raise serializers.ValidationError('An adjustment must change the quantity.')
+        return value
+
+    def create(self, validated_data):
+        return stock.adjust(validated_data['product'], validated_data['quantity'], validated_data.get('note', ''))
+
+
+class ReorderLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField(source='product.pk')
+    reference = serializers.CharField(source='product.reference')
+    name = serializers.CharField(source='product.name')
+    supplier = serializers.IntegerField(source='product.supplier_id')
+    current_quantity = serializers.IntegerField(source='product.current_quantity')
+    on_order = serializers.IntegerField(source='product.on_order')
+    shortfall = serializers.IntegerField()
+    units = serializers.IntegerField()
+
+
+class VehicleCostSerializer(serializers.Serializer):
+    vehicle = serializers.IntegerField()
+    vehicle_name = serializers.CharField(source='vehicle__name')
+    period = serializers.SerializerMethodField()
+    total_cost = serializers.DecimalField(max_digits=12, decimal_places=2)
+    reparations = serializers.IntegerField()
+    km = serializers.SerializerMethodField()
+    cost_per_km = serializers.SerializerMethodField()
+
+    def get_period(self, row):
+        period = row.get('period')
+        if period is None:
+            return None
+        if self.context.get('group') == 'quarter':
+            return f'{period.year}-Q{(period.month - 1) // 3 + 1}'
+        return f'{period:%Y-%m}'
+
+    # Distance between the first and last odometer readings of the period
+    def get_km(self, row):
+        if row['min_odometer'] is None:
+            return None
+        return row['max_odometer'] - row['min_odometer']
+
+    def get_cost_per_km(self, row):
+        km = self.get_km(row)
+        if not km:
+            return None
+        return str((row['total_cost'] / km).quantize(Decimal('0.0001')))
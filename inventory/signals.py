@@ -1,6 +1,14 @@
-from django.db.models.signals import post_save, pre_save
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete
 from django.dispatch import receiver
-from .models import Order, Invoice, Product
+from .models import (Order, OrderItem, Invoice, Product, Supplier, Vehicle, Driver, ReparationProduct,
+                     ReparationProductItem, StockMovement, VehicleCostRollup)
+from . import stock
+from .cache import invalidate
+from .numbers import allocate
 from django.contrib.auth.models import User
 from .models import UserProfile
 import uuid
@@ -9,8 +17,130 @@ import uuid
 def create_invoice(sender, instance, created, **kwargs):
     if created:
         # If a new order is created, create a corresponding invoice
-        invoice_number = 'INV-' + str(instance.id)
+        invoice_number, = allocate('invoice')
         invoice = Invoice(order=instance, invoice_number=invoice_number)
         invoice.save()
 
 
+def _refresh_order_totals(item):
+    order_ids = {item.Order_id, getattr(item, '_loaded_order_id', None)} - {None}
+    Order.objects.filter(pk__in=order_ids).update_totals()
+
+
+@receiver(post_save, sender=OrderItem)
+def update_order_total_on_save(sender, instance, **kwargs):
+    _refresh_order_totals(instance)
+    instance._loaded_order_id = instance.Order_id
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_order_total_on_delete(sender, instance, origin=None, **kwargs):
+    # Items removed by deleting their order need no total
+    if isinstance(origin, Order):
+        return
+    _refresh_order_totals(instance)
+
+
+_bulk_item_changes = ContextVar('bulk_item_changes', default=False)
+
+
+@contextmanager
+def bulk_item_changes():
+    # For bulk item edits that update the total and the stock themselves
+    token = _bulk_item_changes.set(True)
+    try:
+        yield
+    finally:
+        _bulk_item_changes.reset(token)
+
+
+@receiver(post_save, sender=ReparationProductItem)
+def update_reparation_on_item_save(sender, instance, **kwargs):
+    if _bulk_item_changes.get():
+        return
+    ReparationProduct.objects.filter(pk=instance.reparation_product_id).update_totals()
+    used = defaultdict(int)
+    loaded_product_id, loaded_quantity = getattr(instance, '_loaded_line', (None, 0))
+    if loaded_product_id is not None:
+        used[loaded_product_id] -= loaded_quantity
+    used[instance.product_id] += instance.quantity
+    stock.consume(instance.reparation_product, used)
+    instance._loaded_line = (instance.product_id, instance.quantity)
+
+
+def _origin_model(origin):
+    # delete() passes the instance or the queryset it was called on
+    return getattr(origin, 'model', type(origin))
+
+
+@receiver(post_delete, sender=ReparationProductItem)
+def update_reparation_on_item_delete(sender, instance, origin=None, **kwargs):
+    if _bulk_item_changes.get():
+        return
+    origin_model = _origin_model(origin)
+    if origin_model is Product:
+        # The product's movements are deleted with it; only the total changes
+        ReparationProduct.objects.filter(pk=instance.reparation_product_id).update_totals()
+        return
+    if origin_model is not ReparationProductItem:
+        # The reparation is going away too (directly, or with its vehicle or
+        # driver) and puts back all of its parts in cancel_reparation_consumption
+        return
+    ReparationProduct.objects.filter(pk=instance.reparation_product_id).update_totals()
+    stock.consume(instance.reparation_product, {instance.product_id: -instance.quantity})
+
+
+@receiver(pre_delete, sender=ReparationProduct)
+def cancel_reparation_consumption(sender, instance, **kwargs):
+    # Before its items are deleted, whatever the reparation is deleted with
+    stock.cancel_consumption(instance)
+
+
+@receiver(post_save, sender=Order)
+def receive_delivered_order(sender, instance, created, **kwargs):
+    if instance.is_delivered and not getattr(instance, '_loaded_is_delivered', False):
+        # Deferred to commit so items written after the order are included
+        transaction.on_commit(lambda: stock.receive_order(instance))
+    instance._loaded_is_delivered = instance.is_delivered
+
+
+@receiver(pre_delete, sender=Order)
+def cancel_order_receipts(sender, instance, **kwargs):
+    # Before the receipts lose their order
+    stock.cancel_receipts(instance)
+
+
+# Invalidate the cached catalog responses of a model when it changes
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Supplier)
+@receiver([post_save, post_delete], sender=Vehicle)
+@receiver([post_save, post_delete], sender=Driver)
+def invalidate_catalog_cache(sender, **kwargs):
+    invalidate(sender)
+
+
+# Order representations include their items, so item changes bump the order version
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+def invalidate_order_cache(sender, **kwargs):
+    invalidate(Order)
+
+
+@receiver(post_save, sender=ReparationProduct)
+def refresh_cost_rollup_on_save(sender, instance, created, **kwargs):
+    # Total changes refresh the rollup in update_totals()/recalculate_total()
+    loaded_vehicle_id, loaded_odometer = getattr(instance, '_loaded_rollup', (None, None))
+    if created or (instance.vehicle_id, instance.odometer) != (loaded_vehicle_id, loaded_odometer):
+        buckets = {instance.rollup_bucket}
+        if loaded_vehicle_id is not None:
+            buckets.add((loaded_vehicle_id, instance.rollup_bucket[1]))
+        VehicleCostRollup.objects.refresh(buckets)
+    instance._loaded_rollup = (instance.vehicle_id, instance.odometer)
+
+
+@receiver(post_delete, sender=ReparationProduct)
+def refresh_cost_rollup_on_delete(sender, instance, origin=None, **kwargs):
+    # The vehicle's rollups are deleted along with it
+    if isinstance(origin, Vehicle):
+        return
+    VehicleCostRollup.objects.refresh([instance.rollup_bucket])
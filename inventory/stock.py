@@ -0,0 +1,136 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .cache import invalidate
+from .models import Product, StockMovement
+
+# Products per UPDATE when applying deltas, keeps the CASE under SQLite's
+# bound parameter limit.
+UPDATE_CHUNK_SIZE = 400
+
+
+def record_movements(movements):
+    """
+    Append movements to the ledger and apply them to
+    Product.current_quantity in the same transaction.
+    """
+    movements = [movement for movement in movements if movement.quantity]
+    if not movements:
+        return []
+    deltas = defaultdict(int)
+    for movement in movements:
+        deltas[movement.product_id] += movement.quantity
+    with transaction.atomic():
+        StockMovement.objects.bulk_create(movements)
+        apply_deltas(deltas)
+    return movements
+
+
+def apply_deltas(deltas):
+    # UPDATE ... SET current_quantity = current_quantity + CASE id WHEN ... END,
+    # computed by the database so concurrent writers cannot lose updates.
+    deltas = [(pk, delta) for pk, delta in deltas.items() if delta]
+    for start in range(0, len(deltas), UPDATE_CHUNK_SIZE):
+        chunk = deltas[start:start + UPDATE_CHUNK_SIZE]
+        Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            current_quantity=F('current_quantity') + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in chunk],
+                default=Value(0), output_field=IntegerField(),
+            )
+        )
+    if deltas:
+        invalidate(Product)
+
+
+def receive_order(order):
+    """Record the receipt of a delivered order, once."""
+    # Orders are placed in units of items_per_unit items
+    received = (
+        order.orderitem_set.values('product')
+        .annotate(received=Sum(F('quantity') * F('product__items_per_unit')))
+        .order_by('product')
+    )
+    try:
+        # The check and the insert in one transaction; the unique receipt
+        # constraint catches a concurrent delivery of the same order
+        with transaction.atomic():
+            if StockMovement.objects.filter(order=order, kind='R').exists():
+                return []
+            return record_movements([
+                StockMovement(
+                    product_id=line['product'],
+                    kind='R',
+                    quantity=line['received'],
+                    order=order,
+                    note=f'Delivery of order {order.order_number}',
+                )
+                for line in received
+            ])
+    except IntegrityError:
+        return []
+
+
+def cancel_receipts(order):
+    """Take back the stock an order being deleted brought in."""
+    received = (
+        StockMovement.objects.filter(order=order, kind='R')
+        .values('product').annotate(received=Sum('quantity')).order_by('product')
+    )
+    return record_movements([
+        StockMovement(
+            product_id=line['product'], kind='R', quantity=-line['received'],
+            note=f'Order {order.order_number} deleted',
+        )
+        for line in received
+    ])
+
+
+def consume(reparation, used):
+    """Record the parts used by a reparation; `used` maps product ids to quantities."""
+    return record_movements([
+        StockMovement(
+            product_id=product_id,
+            kind='C',
+            quantity=-quantity,
+            reparation_product=reparation,
+            note=f'Reparation {reparation.pk}',
+        )
+        for product_id, quantity in used.items()
+    ])
+
+
+def cancel_consumption(reparation):
+    """Put back the parts of a reparation being deleted, in one movement per product."""
+    used = (
+        reparation.reparationproductitem_set.values('product')
+        .annotate(used=Sum('quantity')).order_by('product')
+    )
+    # The reversal cannot point at the reparation, it is going away
+    return record_movements([
+        StockMovement(
+            product_id=line['product'], kind='C', quantity=line['used'],
+            note=f'Reparation {reparation.pk} deleted',
+        )
+        for line in used
+    ])
+
+
+def adjust(product, quantity, note=''):
+    movements = record_movements([StockMovement(product=product, kind='A', quantity=quantity, note=note)])
+    return movements[0] if movements else None
+
+
+def rebuild_quantities():
+    """Recompute every Product.current_quantity from the ledger in one UPDATE."""
+    totals = (
+        StockMovement.objects.filter(product=OuterRef('pk'))
+        .values('product')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    updated = Product.objects.update(current_quantity=Coalesce(Subquery(totals), Value(0)))
+    invalidate(Product)
+    return updated
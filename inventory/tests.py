@@ -1,3 +1,1418 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime as dt
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from inventory_management.db.sqlite3.base import DatabaseWrapper
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import (Product, Sequence, Supplier, Order, OrderItem, Invoice, Vehicle, Driver, ReparationProduct,
+                     ReparationProductItem, ReparationInvoice, StockMovement, VehicleCostRollup)
+from .cache import cache_stats, get_cache
+from .search import _search_like, search_products
+from .serializers import ProductSerializer
+from . import forecast, numbers, stock
+from .bulk import create_orders
+from .lookup import ProductLookupCache
+from .reorder import plan_reorders, reorder
+from .middleware import PRIMARY_COOKIE, QueryProfilingMiddleware, ReplicaReadMiddleware, fingerprint, serialize
+from .routers import ReplicaRouter, primary_reads, reading_from_replica, replica_reads
+from .stock import adjust, rebuild_quantities
+
+
+class InventoryAPITestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('staff', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.supplier = Supplier.objects.create(name='Acme Parts')
+
+    def make_product(self, name='Oil filter', reference='OF-100', unit_price='10.00', **kwargs):
+        kwargs.setdefault('min_quantity', 5)
+        kwargs.setdefault('low_quantity', 10)
+        return Product.objects.create(name=name, reference=reference, unit_price=Decimal(unit_price), **kwargs)
+
+    def make_order(self, items=(), **kwargs):
+        kwargs.setdefault('supplier', self.supplier)
+        order = Order(**kwargs)
+        order.save()
+        for product, quantity in items:
+            OrderItem.objects.create(Order=order, product=product, quantity=quantity)
+        return order
+
+    def make_vehicle(self, plate='AB-123-CD'):
+        return Vehicle.objects.create(name='Truck ' + plate, code=plate, license_plate=plate)
+
+
+class KeysetPaginationTests(InventoryAPITestCase):
+
+    def test_pages_through_orders_without_gaps_or_duplicates(self):
+        orders = [self.make_order() for _ in range(5)]
+        url = reverse('order_list') + '?limit=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(order['id'] for order in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [order.id for order in reversed(orders)])
+
+    def test_previous_link_returns_the_preceding_page(self):
+        for _ in range(5):
+            self.make_order()
+        first = self.client.get(reverse('order_list') + '?limit=2')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [order['id'] for order in back.data['results']],
+            [order['id'] for order in first.data['results']],
+        )
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('order_list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def cursor(self, *position):
+        return base64.urlsafe_b64encode(json.dumps({'p': list(position)}).encode()).decode()
+
+    def test_tampered_cursors_are_rejected(self):
+        driver = Driver.objects.create(name='Sam')
+        ReparationProduct.objects.create(vehicle=self.make_vehicle(), driver=driver)
+        self.make_order()
+        self.make_product(current_quantity=0)
+        cases = [
+            ('order_list', ['yesterday', 1]),
+            ('order_list', [None, 1]),
+            ('order_list', ['2024-01-01T00:00:00Z', 'one']),
+            ('product_low_stock', ['deep', 1]),
+            ('product_low_stock', [[1], 1]),
+            ('reparation_product_list', [{'at': 1}, 1]),
+        ]
+        for name, position in cases:
+            with self.subTest(name=name, position=position):
+                response = self.client.get(reverse(name), {'cursor': self.cursor(*position)})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data, {'detail': 'Invalid cursor'})
+
+    def test_pages_through_reparations(self):
+        driver = Driver.objects.create(name='Sam')
+        truck = self.make_vehicle()
+        reparations = [ReparationProduct.objects.create(vehicle=truck, driver=driver) for _ in range(3)]
+        first = self.client.get(reverse('reparation_product_list') + '?limit=2')
+        second = self.client.get(first.data['next'])
+        self.assertEqual(
+            [reparation['id'] for reparation in first.data['results'] + second.data['results']],
+            [reparation.id for reparation in reversed(reparations)],
+        )
+        self.assertIsNone(second.data['next'])
+
+    @override_settings(PAGINATION_MAX_PAGE_SIZE=2)
+    def test_max_page_size_is_read_from_settings(self):
+        for _ in range(3):
+            self.make_order()
+        response = self.client.get(reverse('order_list') + '?limit=100')
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class OrderReadTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filter = self.make_product()
+        self.belt = self.make_product(name='Belt', reference='BE-200', unit_price='4.50')
+
+    def test_list_returns_line_items_in_constant_queries(self):
+        for _ in range(3):
+            self.make_order(items=[(self.filter, 2), (self.belt, 4)])
+        # The version tokens, the orders page and all of their items
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('order_list'))
+        self.assertEqual(len(response.data['results']), 3)
+        item = response.data['results'][0]['items'][1]
+        self.assertEqual(item['product']['reference'], 'BE-200')
+        self.assertEqual(item['quantity'], 4)
+        self.assertEqual(Decimal(item['line_total']), Decimal('18.00'))
+
+    def test_detail_uses_the_same_representation(self):
+        order = self.make_order(items=[(self.filter, 1)])
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('order_detail', args=[order.pk]))
+        self.assertEqual([item['quantity'] for item in response.data['items']], [1])
+
+
+class OrderTotalTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filter = self.make_product()
+        self.belt = self.make_product(name='Belt', reference='BE-200', unit_price='4.50')
+
+    def test_total_follows_item_create_update_and_delete(self):
+        order = self.make_order()
+        response = self.client.post(reverse('order_item_create'), {'Order': order.pk, 'product': self.filter.pk, 'quantity': 3})
+        self.assertEqual(response.status_code, 201)
+        item_id = response.data['id']
+        self.client.post(reverse('order_item_create'), {'Order': order.pk, 'product': self.belt.pk, 'quantity': 2})
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('39.00'))
+
+        self.client.patch(reverse('order_item_update', args=[item_id]), {'quantity': 1})
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('19.00'))
+
+        self.client.delete(reverse('order_item_delete', args=[item_id]))
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('9.00'))
+
+    def test_moving_an_item_refreshes_both_orders(self):
+        first = self.make_order(items=[(self.filter, 2)])
+        second = self.make_order()
+        item = OrderItem.objects.get(Order=first)
+        item.Order = second
+        item.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.total_price, second.total_price), (Decimal('0.00'), Decimal('20.00')))
+
+    def test_saving_an_order_is_a_single_write(self):
+        order = self.make_order(items=[(self.filter, 2), (self.belt, 2)])
+        order.status = 'CN'
+        # The order row and its cache version token
+        with self.assertNumQueries(2):
+            order.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('29.00'))
+
+
+class OrderWithItemsCreateTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            self.make_product(name=f'Part {n}', reference=f'P-{n:03d}', unit_price='3.00')
+            for n in range(20)
+        ]
+
+    def create_order(self, products):
+        return self.client.post(reverse('order_create_with_items'), {
+            'supplier': self.supplier.pk,
+            'items': [{'product': product.pk, 'quantity': 2} for product in products],
+        }, format='json')
+
+    def test_creates_order_items_and_invoice_with_the_final_total(self):
+        response = self.create_order(self.products[:3])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('18.00'))
+        self.assertEqual([item['quantity'] for item in response.data['items']], [2, 2, 2])
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.order_id, response.data['id'])
+        self.assertEqual(invoice.total_price, Decimal('18.00'))
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        with CaptureQueriesContext(connection) as small:
+            self.create_order(self.products[:2])
+        with CaptureQueriesContext(connection) as large:
+            self.create_order(self.products)
+        self.assertEqual(len(large), len(small))
+
+    def test_invalid_line_rolls_back_everything(self):
+        response = self.client.post(reverse('order_create_with_items'), {
+            'supplier': self.supplier.pk,
+            'items': [{'product': self.products[0].pk, 'quantity': 1}, {'product': 999999, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class BulkUpsertTests(InventoryAPITestCase):
+
+    def product_row(self, reference, **values):
+        row = {'name': 'Brake pad', 'reference': reference, 'unit_price': '12.00',
+               'items_per_unit': 1, 'min_quantity': 2, 'low_quantity': 4}
+        row.update(values)
+        return row
+
+    def test_products_are_created_updated_or_left_alone(self):
+        self.make_product(name='Brake pad', reference='BP-1', unit_price='12.00', min_quantity=2, low_quantity=4)
+        self.make_product(name='Brake pad', reference='BP-2', unit_price='12.00', min_quantity=2, low_quantity=4)
+        response = self.client.post(reverse('product_bulk_upsert'), [
+            self.product_row('BP-1'),
+            self.product_row('BP-2', unit_price='15.00'),
+            self.product_row('BP-3'),
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data, {'created': 1, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(Product.objects.get(reference='BP-2').unit_price, Decimal('15.00'))
+        self.assertTrue(Product.objects.get(reference='BP-3').SKU.startswith('BRA-'))
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(reverse('product_bulk_upsert'), [self.product_row('S-1')], format='json')
+        rows = [self.product_row(f'L-{n}') for n in range(100)]
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(reverse('product_bulk_upsert'), rows, format='json')
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Product.objects.count(), 101)
+
+    def test_duplicate_keys_reject_the_whole_batch(self):
+        response = self.client.post(reverse('driver_bulk_upsert'), [{'name': 'Sam'}, {'name': 'Sam'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Driver.objects.exists())
+
+    def test_vehicles_are_matched_on_license_plate(self):
+        vehicle = self.make_vehicle('XY-1')
+        response = self.client.post(reverse('vehicle_bulk_upsert'), [
+            {'name': 'Renamed', 'code': 'XY-1', 'license_plate': 'XY-1'},
+        ], format='json')
+        self.assertEqual(response.data['updated'], 1)
+        vehicle.refresh_from_db()
+        self.assertEqual(vehicle.name, 'Renamed')
+
+
+class ReparationTestCase(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.driver = Driver.objects.create(name='Sam')
+        self.products = [
+            self.make_product(name=f'Part {n}', reference=f'P-{n:03d}', unit_price='2.50')
+            for n in range(30)
+        ]
+
+    def create_reparation(self, vehicle, lines):
+        return self.client.post(reverse('reparation_product_list_create'), {
+            'vehicle': vehicle.pk,
+            'driver': self.driver.pk,
+            'products': [{'product': product.pk, 'quantity': 2} for product in lines],
+        }, format='json')
+
+
+class ReparationCreateTests(ReparationTestCase):
+
+    def test_total_is_computed_on_create(self):
+        response = self.create_reparation(self.make_vehicle(), self.products[:3])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('15.00'))
+        self.assertEqual(ReparationProduct.objects.get().total_price, Decimal('15.00'))
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        with CaptureQueriesContext(connection) as small:
+            self.create_reparation(self.make_vehicle('SMALL'), self.products[:2])
+        with CaptureQueriesContext(connection) as large:
+            response = self.create_reparation(self.make_vehicle('LARGE'), self.products)
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('150.00'))
+
+    def test_unknown_product_is_a_validation_error(self):
+        response = self.client.post(reverse('reparation_product_list_create'), {
+            'vehicle': self.make_vehicle().pk,
+            'driver': self.driver.pk,
+            'products': [{'product': 999999, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReparationProduct.objects.exists())
+
+
+class ReparationUpdateTests(ReparationTestCase):
+
+    def test_update_applies_a_diff_of_the_lines(self):
+        vehicle = self.make_vehicle()
+        created = self.create_reparation(vehicle, self.products[:3]).data
+        kept, changed, dropped = (line['id'] for line in created['products'])
+        url = reverse('reparation_product_retrieve_update_destroy', args=[created['id']])
+        response = self.client.put(url, {
+            'vehicle': vehicle.pk,
+            'driver': self.driver.pk,
+            'products': [
+                {'product': self.products[0].pk, 'quantity': 2},
+                {'product': self.products[1].pk, 'quantity': 5},
+                {'product': self.products[3].pk, 'quantity': 1},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        lines = {item.pk: item.quantity for item in ReparationProductItem.objects.all()}
+        self.assertEqual(lines[kept], 2)
+        self.assertEqual(lines[changed], 5)
+        self.assertNotIn(dropped, lines)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('20.00'))
+        self.assertEqual(ReparationProduct.objects.get().total_price, Decimal('20.00'))
+
+    def test_partial_update_without_lines_keeps_them(self):
+        created = self.create_reparation(self.make_vehicle(), self.products[:2]).data
+        url = reverse('reparation_product_retrieve_update_destroy', args=[created['id']])
+        response = self.client.patch(url, {'location': 'Depot 2'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(response.data['products']), 2)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('10.00'))
+
+
+class ImportHistoryTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filter = self.make_product()
+        self.belt = self.make_product(name='Belt', reference='BE-200', unit_price='4.50')
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_imports_orders_with_totals_invoices_and_original_dates(self):
+        path = self.write_file('.csv', (
+            'order_number,supplier,date_ordered,status,product_reference,quantity\n'
+            'H-1,Acme Parts,2019-03-01T10:00:00,C,OF-100,2\n'
+            'H-1,Acme Parts,2019-03-01T10:00:00,C,BE-200,2\n'
+            'H-2,Acme Parts,2019-04-01,P,OF-100,1\n'
+            'H-3,Unknown Ltd,2019-05-01,P,OF-100,1\n'
+        ))
+        out = StringIO()
+        call_command('import_history', 'orders', path, stdout=out, stderr=StringIO())
+        self.assertIn('Imported 2 orders (4 rows)', out.getvalue())
+        first = Order.objects.get(order_number='H-1')
+        self.assertEqual(first.total_price, Decimal('29.00'))
+        self.assertEqual(first.date_ordered.year, 2019)
+        self.assertEqual(Invoice.objects.get(order=first).total_price, Decimal('29.00'))
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+    def test_non_finite_quantities_are_row_errors(self):
+        path = self.write_file('.csv', (
+            'order_number,supplier,date_ordered,status,product_reference,quantity\n'
+            'H-1,Acme Parts,2019-03-01,P,OF-100,NaN\n'
+            'H-2,Acme Parts,2019-03-01,P,OF-100,Infinity\n'
+            'H-3,Acme Parts,2019-03-01,P,OF-100,1\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_history', 'orders', path, stdout=out, stderr=err)
+        self.assertIn('Imported 1 orders (3 rows)', out.getvalue())
+        self.assertIn('2 skipped', out.getvalue())
+        self.assertIn("invalid number 'NaN'", err.getvalue())
+        self.assertIn("invalid number 'Infinity'", err.getvalue())
+
+    def test_fractional_quantities_are_row_errors(self):
+        path = self.write_file('.csv', (
+            'order_number,supplier,date_ordered,status,product_reference,quantity\n'
+            'H-1,Acme Parts,2019-03-01,P,OF-100,2.5\n'
+            'H-2,Acme Parts,2019-03-01,P,OF-100,2.0\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_history', 'orders', path, stdout=out, stderr=err)
+        self.assertIn('Imported 1 orders (2 rows)', out.getvalue())
+        self.assertIn("order H-1: '2.5' is not a whole number", err.getvalue())
+        self.assertEqual(OrderItem.objects.get().quantity, 2)
+
+    def test_clashing_documents_are_skipped(self):
+        existing = self.make_order()
+        path = self.write_file('.csv', (
+            'order_number,supplier,date_ordered,status,product_reference,quantity\n'
+            'H-1,Acme Parts,2019-03-01,P,OF-100,1\n'
+            f'{existing.order_number},Acme Parts,2019-03-01,P,OF-100,1\n'
+            'H-2,Acme Parts,2019-03-01,P,OF-100,1\n'
+            'H-1,Acme Parts,2019-03-01,P,BE-200,1\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_history', 'orders', path, stdout=out, stderr=err)
+        self.assertIn('Imported 2 orders (4 rows)', out.getvalue())
+        self.assertIn('2 skipped', out.getvalue())
+        self.assertIn(f'Skipped: order {existing.order_number}: clashes with existing data', err.getvalue())
+        self.assertEqual(
+            sorted(Order.objects.exclude(pk=existing.pk).values_list('order_number', flat=True)), ['H-1', 'H-2'],
+        )
+        self.assertEqual(Invoice.objects.filter(order__order_number__in=['H-1', 'H-2']).count(), 2)
+
+        with self.assertRaisesMessage(CommandError, 'clashes with existing data'):
+            call_command('import_history', 'orders', path, '--strict', stdout=StringIO(), stderr=StringIO())
+
+    def test_ndjson_lines_must_be_objects(self):
+        path = self.write_file('.ndjson', '{"order_number": "H-1"}\n[1, 2]\n')
+        with self.assertRaisesMessage(CommandError, 'Line 2 is not a JSON object'):
+            call_command('import_history', 'orders', path, stdout=StringIO(), stderr=StringIO())
+
+    def test_imports_reparations_from_ndjson(self):
+        self.make_vehicle('AA-1')
+        Driver.objects.create(name='Sam')
+        lines = [
+            {'license_plate': 'AA-1', 'driver': 'Sam', 'date_repaired': '2020-01-02T08:00:00', 'odometer': 1200,
+             'product_reference': 'OF-100', 'quantity': 1},
+            {'license_plate': 'AA-1', 'driver': 'Sam', 'date_repaired': '2020-01-02T08:00:00', 'odometer': 1200,
+             'product_reference': 'BE-200', 'quantity': 2},
+        ]
+        path = self.write_file('.ndjson', ''.join(json.dumps(line) + '\n' for line in lines))
+        call_command('import_history', 'reparations', path, stdout=StringIO())
+        reparation = ReparationProduct.objects.get()
+        self.assertEqual(reparation.total_price, Decimal('19.00'))
+        self.assertEqual(reparation.date_repaired.year, 2020)
+        self.assertEqual(ReparationInvoice.objects.get().total_price, Decimal('19.00'))
+
+
+class ExportTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filter = self.make_product()
+        self.old = self.make_order(items=[(self.filter, 2)])
+        Order.objects.filter(pk=self.old.pk).update(date_ordered='2020-01-15T00:00:00Z')
+        self.new = self.make_order(items=[(self.filter, 3)])
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_order_export_streams_flattened_csv(self):
+        response = self.client.get(reverse('order_export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(self.read(response))))
+        self.assertEqual([row['order_number'] for row in rows], [self.old.order_number, self.new.order_number])
+        self.assertEqual(rows[0]['supplier'], 'Acme Parts')
+        self.assertEqual(rows[1]['product_reference'], 'OF-100')
+        self.assertEqual(Decimal(rows[1]['line_total']), Decimal('30.00'))
+        self.assertEqual(rows[1]['invoice_number'], self.new.invoice_set.get().invoice_number)
+
+    def test_date_range_and_ndjson(self):
+        response = self.client.get(reverse('order_export') + '?format=ndjson&date_from=2020-01-01&date_to=2020-01-31')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([row['order_number'] for row in rows], [self.old.order_number])
+
+    def test_stock_export_includes_stock_value(self):
+        Product.objects.filter(pk=self.filter.pk).update(current_quantity=4)
+        rows = list(csv.DictReader(StringIO(self.read(self.client.get(reverse('stock_export'))))))
+        self.assertEqual(Decimal(rows[0]['stock_value']), Decimal('40.00'))
+
+    def test_invalid_date_is_rejected(self):
+        for suffix in ('', '&format=csv', '&format=ndjson'):
+            with self.subTest(suffix=suffix):
+                response = self.client.get(reverse('order_export') + '?date_from=yesterday' + suffix)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertEqual(json.loads(response.content), {'date_from': 'Expected a date formatted YYYY-MM-DD.'})
+
+    def test_lines_are_exported_once_whatever_the_invoices(self):
+        Invoice.objects.create(order=self.new, invoice_number='INV-EXTRA')
+        rows = list(csv.DictReader(StringIO(self.read(self.client.get(reverse('order_export'))))))
+        self.assertEqual([row['order_number'] for row in rows], [self.old.order_number, self.new.order_number])
+        self.assertEqual(rows[1]['invoice_number'], self.new.invoice_set.order_by('id').first().invoice_number)
+
+
+class StockLedgerTests(ReparationTestCase):
+
+    def quantity(self, product):
+        product.refresh_from_db()
+        return product.current_quantity
+
+    def test_delivering_an_order_receives_its_items_once(self):
+        part = self.make_product(name='Spark plug', reference='SP-1', items_per_unit=4)
+        order = self.make_order(items=[(part, 3)])
+        order.is_delivered = True
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(self.quantity(part), 12)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(StockMovement.objects.filter(kind='R').count(), 1)
+
+    def test_receipts_are_unique_per_order_and_product(self):
+        part = self.products[0]
+        order = self.make_order(items=[(part, 1), (part, 2)])
+        self.assertEqual([movement.quantity for movement in stock.receive_order(order)], [3])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StockMovement.objects.create(product=part, kind='R', quantity=3, order=order)
+        # A delivery recorded concurrently makes the late one a no-op
+        StockMovement.objects.filter(order=order).delete()
+        StockMovement.objects.create(product=part, kind='R', quantity=3, order=order)
+        self.assertEqual(stock.receive_order(order), [])
+
+    def test_deleting_a_delivered_order_takes_its_stock_back(self):
+        part = self.products[0]
+        order = self.make_order(items=[(part, 3)])
+        order.is_delivered = True
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(self.quantity(part), 3)
+        order.delete()
+        self.assertEqual(self.quantity(part), 0)
+        rebuild_quantities()
+        self.assertEqual(self.quantity(part), 0)
+
+    def test_reparations_consume_parts_and_edits_apply_the_difference(self):
+        part, other = self.products[:2]
+        vehicle = self.make_vehicle()
+        created = self.create_reparation(vehicle, [part, other]).data
+        self.assertEqual((self.quantity(part), self.quantity(other)), (-2, -2))
+        self.client.put(reverse('reparation_product_retrieve_update_destroy', args=[created['id']]), {
+            'vehicle': vehicle.pk,
+            'driver': self.driver.pk,
+            'products': [{'product': part.pk, 'quantity': 5}],
+        }, format='json')
+        self.assertEqual((self.quantity(part), self.quantity(other)), (-5, 0))
+        self.client.delete(reverse('reparation_product_retrieve_update_destroy', args=[created['id']]))
+        self.assertEqual(self.quantity(part), 0)
+
+    def test_adjustments_and_rebuild_from_the_ledger(self):
+        part = self.products[0]
+        response = self.client.post(reverse('stock_movement_list_create'), {'product': part.pk, 'quantity': 7, 'note': 'Count'})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['kind'], 'A')
+        Product.objects.filter(pk=part.pk).update(current_quantity=999)
+        rebuild_quantities()
+        self.assertEqual(self.quantity(part), 7)
+
+    def test_deleting_what_a_reparation_refers_to(self):
+        part, other = self.products[:2]
+        vehicle = self.make_vehicle()
+        self.create_reparation(vehicle, [part, other])
+        part.delete()
+        # The deferred foreign keys are only checked on commit
+        connection.check_constraints()
+        reparation = ReparationProduct.objects.get()
+        self.assertEqual(reparation.total_price, Decimal('5.00'))
+        self.assertEqual(self.quantity(other), -2)
+
+        vehicle.delete()
+        connection.check_constraints()
+        self.assertFalse(ReparationProduct.objects.exists())
+        self.assertEqual(self.quantity(other), 0)
+        self.assertEqual(rebuild_quantities(), 29)
+        self.assertEqual(self.quantity(other), 0)
+
+    def test_deleting_the_driver_of_a_reparation(self):
+        part = self.products[0]
+        self.create_reparation(self.make_vehicle(), [part])
+        self.driver.delete()
+        connection.check_constraints()
+        self.assertFalse(ReparationProduct.objects.exists())
+        self.assertEqual(self.quantity(part), 0)
+        self.assertEqual(StockMovement.objects.get(kind='C', quantity=2).reparation_product, None)
+
+    def test_deleting_a_reparation_puts_its_parts_back_at_once(self):
+        created = self.create_reparation(self.make_vehicle(), self.products[:3]).data
+        with CaptureQueriesContext(connection) as queries:
+            ReparationProduct.objects.get(pk=created['id']).delete()
+        stock_updates = [query for query in queries if query['sql'].startswith('UPDATE "inventory_product"')]
+        self.assertEqual(len(stock_updates), 1)
+        self.assertEqual([self.quantity(product) for product in self.products[:3]], [0, 0, 0])
+        self.assertEqual(StockMovement.objects.filter(note=f"Reparation {created['id']} deleted").count(), 3)
+
+    def test_movements_are_append_only(self):
+        movement = StockMovement.objects.create(product=self.products[0], kind='A', quantity=1)
+        with self.assertRaises(ValueError):
+            movement.save()
+
+
+class LowStockTests(InventoryAPITestCase):
+
+    def test_lists_products_at_or_below_low_quantity_by_urgency(self):
+        self.make_product(name='Plenty', reference='R-1', current_quantity=50)
+        self.make_product(name='Low', reference='R-2', current_quantity=8)
+        self.make_product(name='Empty', reference='R-3', current_quantity=0)
+        self.make_product(name='Edge', reference='R-4', current_quantity=10)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product_low_stock'))
+        results = response.data['results']
+        self.assertEqual([product['name'] for product in results], ['Empty', 'Low', 'Edge'])
+        self.assertEqual([product['level'] for product in results], ['critical', 'low', 'low'])
+        self.assertEqual(results[0]['stock_margin'], -10)
+
+    def test_pages_on_the_stock_margin(self):
+        for n in range(5):
+            self.make_product(name=f'Part {n}', reference=f'R-{n}', current_quantity=n)
+        first = self.client.get(reverse('product_low_stock') + '?limit=3')
+        second = self.client.get(first.data['next'])
+        self.assertEqual(
+            [product['current_quantity'] for product in first.data['results'] + second.data['results']],
+            [0, 1, 2, 3, 4],
+        )
+
+
+class ReorderPlannerTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Supplier.objects.create(name='Bolt & Co')
+        # Target is low_quantity (10); plugs come in boxes of 4
+        self.plug = self.make_product(name='Plug', reference='PL-1', current_quantity=1, items_per_unit=4, supplier=self.supplier)
+        self.hose = self.make_product(name='Hose', reference='HO-1', current_quantity=2, supplier=self.supplier)
+        self.bolt = self.make_product(name='Bolt', reference='BO-1', current_quantity=0, supplier=self.other)
+        self.fine = self.make_product(name='Fine', reference='FI-1', current_quantity=7, supplier=self.other)
+        self.orphan = self.make_product(name='Orphan', reference='OR-1', current_quantity=0)
+
+    def test_plan_rounds_up_to_units_and_reports_unassigned(self):
+        response = self.client.get(reverse('order_reorder_plan'))
+        lines = {line['reference']: line for line in response.data['lines']}
+        self.assertEqual(set(lines), {'PL-1', 'HO-1', 'BO-1'})
+        self.assertEqual((lines['PL-1']['shortfall'], lines['PL-1']['units']), (9, 3))
+        self.assertEqual(lines['HO-1']['units'], 8)
+        self.assertEqual(response.data['unassigned'], [self.orphan.pk])
+
+    def test_creates_one_pending_order_per_supplier_once(self):
+        response = self.client.post(reverse('order_reorder_plan'))
+        self.assertEqual(response.status_code, 201)
+        orders = {order['supplier']: order for order in response.data['orders']}
+        self.assertEqual(len(orders[self.supplier.pk]['items']), 2)
+        self.assertEqual(Decimal(orders[self.other.pk]['total_price']), Decimal('100.00'))
+        self.assertEqual(Invoice.objects.count(), 2)
+        # Pending quantities count as stock, so a second run plans nothing
+        again = self.client.get(reverse('order_reorder_plan'))
+        self.assertEqual(again.data['lines'], [])
+
+    def test_failed_reorder_leaves_the_plan_unchanged(self):
+        planned = plan_reorders()
+        with mock.patch('inventory.reorder.create_orders', side_effect=IntegrityError('clash')):
+            with self.assertRaises(IntegrityError):
+                reorder()
+        self.assertFalse(Order.objects.exists())
+        orders, unassigned = reorder()
+        self.assertEqual(len(orders), 2)
+        self.assertEqual((plan_reorders()[0], unassigned), ([], planned[1]))
+        self.assertEqual(
+            sorted((item.product_id, item.quantity) for order in orders for item in order.orderitem_set.all()),
+            sorted((line.product.pk, line.units) for line in planned[0]),
+        )
+
+
+class CatalogCacheTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.product = self.make_product()
+
+    def test_second_read_is_served_from_cache(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        hits = cache_stats()['hits']
+        # Only the version tokens are read
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['name'], 'Oil filter')
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+
+    def test_saving_a_product_invalidates_cached_reads(self):
+        url = reverse('product_list')
+        self.client.get(url)
+        self.product.name = 'Air filter'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Air filter')
+
+    def test_stock_movements_invalidate_cached_quantities(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(url)
+        adjust(self.product, 7)
+        self.assertEqual(self.client.get(url).data['current_quantity'], 7)
+
+    def test_other_models_keep_their_entries(self):
+        url = reverse('supplier_list')
+        self.client.get(url)
+        self.make_product(name='Belt', reference='BE-200')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+
+class ConditionalGetTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.product = self.make_product()
+
+    def test_matching_etag_is_answered_from_the_version_tokens(self):
+        url = reverse('product_list')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+    def test_changes_produce_a_new_etag(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        etag = self.client.get(url)['ETag']
+        adjust(self.product, 3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_versions_are_shared_through_the_database(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        etag = self.client.get(url)['ETag']
+        # Another process has its own cache, and changes the product
+        get_cache().clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Sequence.objects.filter(name='version:inventory.product').update(value=F('value') + 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_items_invalidate_the_order(self):
+        order = self.make_order()
+        url = reverse('order_detail', args=[order.pk])
+        etag = self.client.get(url)['ETag']
+        OrderItem.objects.create(Order=order, product=self.product, quantity=2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 1)
+
+    def test_if_modified_since(self):
+        url = reverse('vehicle_list')
+        self.make_vehicle()
+        # Changed 0.6s into a second, a while ago
+        changed = int(time.time()) - 10
+        Sequence.objects.filter(name='version:inventory.vehicle').update(value=changed * 10 ** 9 + 6 * 10 ** 8)
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(last_modified, http_date(changed + 1))
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        # A client that fetched earlier in the second of the change has not seen it
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(changed)).status_code, 200)
+
+    def test_last_modified_waits_for_the_second_of_the_change_to_pass(self):
+        url = reverse('vehicle_list')
+        self.make_vehicle()
+        # Stamped a second ahead, so the request cannot run after the second is over
+        Sequence.objects.filter(name='version:inventory.vehicle').update(value=time.time_ns() + 10 ** 9)
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+
+class ProductSearchTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.oil = self.make_product(name='Oil filter', reference='OF-100')
+        self.air = self.make_product(name='Air filter', reference='AF-200')
+        self.belt = self.make_product(name='Timing belt', reference='TB-300')
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('product_search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['reference'] for product in response.data]
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'The search index is SQLite only')
+    def test_index_triggers_survive_the_migrations(self):
+        # A migration rebuilding inventory_product on SQLite drops them
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'inventory_product'")
+            triggers = sorted(name for name, in cursor.fetchall())
+        self.assertEqual(triggers, ['inventory_product_fts_ad', 'inventory_product_fts_ai', 'inventory_product_fts_au'])
+
+    def test_matches_prefixes_of_every_term(self):
+        self.assertEqual(set(self.search('filt')), {'OF-100', 'AF-200'})
+        self.assertEqual(self.search('oil fil'), ['OF-100'])
+        self.assertEqual(self.search('tb-3'), ['TB-300'])
+        self.assertEqual(self.search(self.belt.SKU), ['TB-300'])
+        self.assertEqual(len(self.search('filter', limit=1)), 1)
+
+    def test_reference_matches_rank_first(self):
+        self.make_product(name='Bracket for AF', reference='BR-900')
+        self.assertEqual(self.search('af')[0], 'AF-200')
+
+    def test_index_follows_writes(self):
+        self.oil.name = 'Fuel filter'
+        self.oil.save()
+        self.belt.delete()
+        self.assertEqual(self.search('fuel'), ['OF-100'])
+        self.assertEqual(self.search('timing'), [])
+        self.client.post(reverse('product_bulk_upsert'), [
+            {'reference': 'SP-1', 'name': 'Spark plug', 'unit_price': '3.00', 'min_quantity': 1, 'low_quantity': 2},
+        ], format='json')
+        self.assertEqual(self.search('spark'), ['SP-1'])
+
+    def test_operators_in_the_query_are_plain_text(self):
+        self.assertEqual(self.search('"oil* (fil'), ['OF-100'])
+
+    def test_query_is_required(self):
+        response = self.client.get(reverse('product_search'), {'q': ' - '})
+        self.assertEqual(response.status_code, 400)
+
+    def test_like_fallback_matches_the_same_products(self):
+        self.assertEqual(list(_search_like(['filt'])), [self.air, self.oil])
+        self.assertEqual(set(search_products('filt')), set(_search_like(['filt'])))
+        self.assertEqual(search_products(' - '), [])
+
+
+class ProductLookupTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.oil = self.make_product(name='Oil filter', reference='OF-100')
+        self.belt = self.make_product(name='Timing belt', reference='TB-300')
+
+    def test_resolves_skus_and_references_in_one_query(self):
+        codes = [self.oil.SKU, 'TB-300', 'NOPE']
+        # The Product version token, then every code at once
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('product_lookup'), {'codes': codes}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['products'][self.oil.SKU]['id'], self.oil.pk)
+        self.assertEqual(response.data['products']['TB-300']['id'], self.belt.pk)
+        self.assertEqual(response.data['missing'], ['NOPE'])
+
+    def test_repeated_scans_are_served_from_memory(self):
+        url = reverse('product_lookup') + '?code=OF-100,NOPE'
+        self.client.get(url)
+        # Only the Product version token is read
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertIn('OF-100', response.data['products'])
+        adjust(self.oil, 4)
+        self.assertEqual(self.client.get(url).data['products']['OF-100']['current_quantity'], 4)
+
+    def test_entries_expire(self):
+        cache = ProductLookupCache(ttl=60)
+        # A lookup records the version the results are stored under
+        cache.get_many(['OF-100'], version=1)
+        cache.set_many({'OF-100': {'id': 1}}, version=1)
+        self.assertEqual(cache.get_many(['OF-100'], version=1), {'OF-100': {'id': 1}})
+        cache.ttl = 0
+        cache.set_many({'OF-100': {'id': 1}}, version=1)
+        self.assertEqual(cache.get_many(['OF-100'], version=1), {})
+
+    def test_codes_are_required(self):
+        self.assertEqual(self.client.get(reverse('product_lookup')).status_code, 400)
+        response = self.client.post(reverse('product_lookup'), {'codes': 'OF-100'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SkuAllocationTests(InventoryAPITestCase):
+
+    def test_skus_count_up_per_prefix(self):
+        first = self.make_product(name='Oil filter', reference='OF-1')
+        second = self.make_product(name='oil pump', reference='OP-1')
+        other = self.make_product(name='#1 belt', reference='BE-1')
+        self.assertEqual((first.SKU, second.SKU, other.SKU), ('OIL-0001', 'OIL-0002', '1BE-0001'))
+
+    def test_skus_already_taken_are_skipped(self):
+        self.make_product(name='Custom', reference='CU-1', SKU='OIL-0001')
+        self.make_product(name='Custom', reference='CU-2', SKU='OIL-0003')
+        products = [Product(name='Oil filter', reference=f'OF-{n}', unit_price=1) for n in range(3)]
+        Product.assign_skus(products)
+        self.assertEqual(sorted(product.SKU for product in products), ['OIL-0002', 'OIL-0004', 'OIL-0005'])
+
+    def test_reserved_blocks_do_not_overlap(self):
+        blocks = Sequence.objects.reserve({'a': 3, 'b': 1})
+        self.assertEqual((list(blocks['a']), list(blocks['b'])), ([1, 2, 3], [1]))
+        self.assertEqual(list(Sequence.objects.reserve({'a': 2})['a']), [4, 5])
+
+    def test_bulk_upsert_reserves_skus_in_constant_queries(self):
+        rows = [
+            {'reference': f'R-{n}', 'name': ('Oil', 'Air', 'Belt')[n % 3] + f' part {n}',
+             'unit_price': '1.00', 'min_quantity': 1, 'low_quantity': 2}
+            for n in range(1200)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('product_bulk_upsert'), rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(
+            'inventory_sequence' in query['sql'] and 'version:' not in query['sql'] for query in queries.captured_queries
+        ), 3)
+        skus = list(Product.objects.values_list('SKU', flat=True))
+        self.assertEqual(len(set(skus)), 1200)
+        self.assertIn('BEL-0400', skus)
+
+
+class DocumentNumberTests(InventoryAPITestCase):
+
+    def test_documents_get_formatted_sequential_numbers(self):
+        first = self.make_order()
+        second = self.make_order(is_delivered=True)
+        self.assertEqual((first.order_number, second.order_number), ('PO-000001', 'PO-000002'))
+        self.assertEqual((second.status, second.delivery_order_number), ('C', 'DO-000001'))
+        self.assertEqual(second.invoice_set.get().invoice_number, 'INV-000002')
+
+    def test_bulk_creation_reserves_numbers_once_per_kind(self):
+        documents = [(Order(supplier=self.supplier), []) for _ in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                orders = create_orders(documents)
+        self.assertEqual(len({order.order_number for order in orders}), 50)
+        reservations = [query['sql'] for query in queries.captured_queries if 'UPDATE "inventory_sequence"' in query['sql']]
+        self.assertEqual(len([sql for sql in reservations if 'version:' not in sql]), 2)
+
+
+class DocumentNumberBlockTests(TransactionTestCase):
+
+    def setUp(self):
+        numbers._blocks.clear()
+
+    def tearDown(self):
+        numbers._blocks.clear()
+
+    def test_numbers_outside_transactions_come_from_a_local_block(self):
+        self.assertEqual(numbers.allocate('order'), ['PO-000001'])
+        with self.assertNumQueries(0):
+            self.assertEqual(numbers.allocate('order', 2), ['PO-000002', 'PO-000003'])
+        # Another process reserves after this one's block
+        self.assertEqual(list(Sequence.objects.reserve({'document:order': 1})['document:order']), [numbers.block_size() + 1])
+
+    def test_numbers_inside_transactions_are_not_kept(self):
+        with transaction.atomic():
+            numbers.allocate('order')
+        self.assertFalse(numbers._blocks['order'])
+        self.assertEqual(Sequence.objects.get(name='document:order').value, 1)
+
+    def test_numbers_inside_transactions_cost_one_reservation_per_call(self):
+        numbers.allocate('order')
+        with transaction.atomic():
+            # What is left of the block is used first
+            with self.assertNumQueries(0):
+                numbers.allocate('order', numbers.block_size() - 1)
+            with CaptureQueriesContext(connection) as one:
+                numbers.allocate('order')
+            with CaptureQueriesContext(connection) as many:
+                self.assertEqual(numbers.allocate('order', 50)[-1], f'PO-{numbers.block_size() + 51:06d}')
+        self.assertEqual(len(one), len(many))
+        self.assertFalse(numbers._blocks['order'])
+
+    @override_settings(DOCUMENT_NUMBER_FORMATS={'order': 'ORD/{number}'}, DOCUMENT_NUMBER_BLOCK_SIZE=10)
+    def test_formats_and_block_size_are_read_from_settings(self):
+        self.assertEqual(numbers.allocate('order'), ['ORD/1'])
+        self.assertEqual(numbers.allocate('invoice'), ['INV-000001'])
+        self.assertEqual(len(numbers._blocks['order']), 9)
+
+    @override_settings(DOCUMENT_NUMBER_FORMATS={'order': 'ORD-{count}'})
+    def test_formats_must_contain_the_number(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "DOCUMENT_NUMBER_FORMATS['order'] must contain {number}"):
+            numbers.allocate('order')
+
+
+class VehicleCostRollupTests(ReparationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.truck = self.make_vehicle()
+
+    def create_reparation(self, vehicle, lines, odometer=None):
+        reparation = super().create_reparation(vehicle, lines).data
+        if odometer is not None:
+            url = reverse('reparation_product_retrieve_update_destroy', args=[reparation['id']])
+            self.client.patch(url, {'odometer': odometer}, format='json')
+        return reparation
+
+    def test_rollup_follows_reparation_changes(self):
+        first = self.create_reparation(self.truck, self.products[:3], odometer=1000)
+        self.create_reparation(self.truck, self.products[3:5], odometer=1500)
+        rollup = VehicleCostRollup.objects.get()
+        self.assertEqual((rollup.total_cost, rollup.reparations), (Decimal('25.00'), 2))
+        self.assertEqual((rollup.min_odometer, rollup.max_odometer), (1000, 1500))
+
+        url = reverse('reparation_product_retrieve_update_destroy', args=[first['id']])
+        self.client.patch(url, {'products': [{'product': self.products[0].pk, 'quantity': 4}]}, format='json')
+        self.assertEqual(VehicleCostRollup.objects.get().total_cost, Decimal('20.00'))
+
+        self.client.delete(url)
+        rollup = VehicleCostRollup.objects.get()
+        self.assertEqual((rollup.total_cost, rollup.reparations, rollup.min_odometer), (Decimal('10.00'), 1, 1500))
+
+    def test_endpoint_reads_costs_per_km_from_the_rollups(self):
+        self.create_reparation(self.truck, self.products[:4], odometer=1000)
+        self.create_reparation(self.truck, self.products[4:8], odometer=1200)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('vehicle_costs'), {'group': 'quarter'})
+        row, = response.data['results']
+        self.assertEqual((row['vehicle'], row['km'], row['cost_per_km']), (self.truck.pk, 200, '0.2000'))
+        self.assertRegex(row['period'], r'^\d{4}-Q[1-4]$')
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.create_reparation(self.truck, self.products[:2], odometer=10)
+        van = self.make_vehicle('XY-987-ZW')
+        self.create_reparation(van, self.products[:1])
+        ReparationProduct.objects.filter(vehicle=self.truck).update(date_repaired=timezone.now() - dt.timedelta(days=400))
+        call_command('rebuild_vehicle_costs', stdout=StringIO())
+        response = self.client.get(reverse('vehicle_costs'), {'group': 'total'})
+        self.assertEqual(
+            [(row['vehicle'], row['total_cost'], row['period']) for row in response.data['results']],
+            [(self.truck.pk, '10.00', None), (van.pk, '5.00', None)],
+        )
+        self.assertEqual(VehicleCostRollup.objects.count(), 2)
+
+
+@unittest.skipIf(forecast.np is None, 'NumPy is not installed')
+class ForecastTests(ReparationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fast, self.slow, self.idle = self.products[:3]
+        # Stock left once the reparations below have used theirs: 40, 40 and 5
+        for product, quantity in ((self.fast, 96), (self.slow, 42), (self.idle, 5)):
+            adjust(product, quantity)
+        truck = self.make_vehicle()
+        # fast: 2 items a day over the last 4 weeks, slow: 2 items once
+        for weeks_ago in range(4):
+            for day in range(7):
+                reparation = ReparationProduct.objects.create(vehicle=truck, driver=self.driver)
+                ReparationProductItem.objects.create(reparation_product=reparation, product=self.fast, quantity=2)
+                ReparationProduct.objects.filter(pk=reparation.pk).update(
+                    date_repaired=timezone.now() - dt.timedelta(weeks=weeks_ago, days=day)
+                )
+        reparation = ReparationProduct.objects.create(vehicle=truck, driver=self.driver, odometer=1)
+        ReparationProductItem.objects.create(reparation_product=reparation, product=self.slow, quantity=2)
+
+    def test_smoothing_weights_match_the_recursion(self):
+        series = forecast.np.array([3.0, 0.0, 5.0, 1.0, 4.0])
+        smoothed = series[0]
+        for value in series[1:]:
+            smoothed = 0.3 * value + 0.7 * smoothed
+        self.assertAlmostEqual(series @ forecast.smoothing_weights(len(series), 0.3), smoothed)
+
+    def test_forecasts_cover_and_stockout_for_every_product(self):
+        today = timezone.localdate()
+        results = {f.product_id: f for f in forecast.compute_forecasts(history_days=28, window=4, today=today)}
+        self.assertEqual(len(results), len(self.products))
+        fast = results[self.fast.pk]
+        self.assertAlmostEqual(fast.weekly_average, 14.0)
+        self.assertAlmostEqual(fast.smoothed_weekly, 14.0)
+        self.assertAlmostEqual(fast.days_of_cover, 20.0)
+        self.assertEqual(fast.stockout_date, today + dt.timedelta(days=20))
+        self.assertGreater(results[self.slow.pk].days_of_cover, fast.days_of_cover)
+        self.assertIsNone(results[self.idle.pk].days_of_cover)
+
+    def test_only_the_lines_of_the_period_are_read(self):
+        read, original = [], forecast.np.fromiter
+
+        def fromiter(*args, **kwargs):
+            read.append(original(*args, **kwargs))
+            return read[-1]
+
+        with mock.patch.object(forecast.np, 'fromiter', side_effect=fromiter):
+            results = {f.product_id: f for f in forecast.compute_forecasts(history_days=7, window=1)}
+        # The last week's 7 lines of the fast part and the slow part's line
+        self.assertEqual(len(read[0]) // 3, 8)
+        self.assertAlmostEqual(results[self.fast.pk].weekly_average, 14.0)
+
+    def test_endpoint_lists_stored_forecasts_soonest_first(self):
+        call_command('forecast_stock', '--history-days=28', '--window=4', stdout=StringIO())
+        response = self.client.get(reverse('product_forecast'))
+        self.assertEqual([row['product'] for row in response.data['results']], [self.fast.pk, self.slow.pk])
+        response = self.client.get(reverse('product_forecast'), {'within': 30})
+        self.assertEqual([row['product'] for row in response.data['results']], [self.fast.pk])
+
+
+class DashboardTests(ReparationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        other = Supplier.objects.create(name='Bolt & Co')
+        part = self.make_product(name='Plug', reference='PL-1', current_quantity=0)
+        self.make_order([(part, 4)])
+        self.make_order([(part, 2)], supplier=other)
+        self.make_order([(part, 1)], supplier=other)
+        self.make_order([(part, 9)], is_delivered=True)
+        adjust(self.products[0], 20)
+        self.create_reparation(self.make_vehicle(), self.products[:3])
+
+    def test_summary_in_few_queries(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('dashboard'))
+        data = response.data
+        self.assertEqual(data['orders_by_status'], {'pending': 3, 'completed': 1, 'cancelled': 0})
+        self.assertEqual(
+            [(row['name'], row['orders'], row['spend']) for row in data['pending_spend_by_supplier']],
+            [('Acme Parts', 1, Decimal('40.00')), ('Bolt & Co', 2, Decimal('30.00'))],
+        )
+        # Parts driven below zero by the reparation are not valued
+        self.assertEqual(data['stock']['products'], 31)
+        self.assertEqual((data['stock']['low_stock'], data['stock']['out_of_stock']), (30, 30))
+        self.assertEqual(data['stock']['valuation'], Decimal('45.00'))
+        self.assertEqual(data['reparations_this_month']['spend'], Decimal('15.00'))
+
+    def test_summary_is_cached_briefly(self):
+        self.client.get(reverse('dashboard'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('dashboard'))
+
+
+class AsyncReadTests(InventoryAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        token = Token.objects.create(user=self.user)
+        self.async_client = AsyncClient()
+        self.product = self.make_product()
+        self.headers = {'Authorization': f'Token {token.key}'}
+
+    def get(self, url, data=None, **headers):
+        return self.async_client.get(url, data, headers={**self.headers, **headers})
+
+    async def test_responses_match_the_sync_endpoints(self):
+        order = await sync_to_async(self.make_order)([(self.product, 3)])
+        for name, args in [('product_detail', [self.product.pk]), ('order_detail', [order.pk]), ('product_list', [])]:
+            response = await self.get(reverse('async_' + name, args=args))
+            self.assertEqual(response.status_code, 200)
+            expected = await sync_to_async(self.client.get)(reverse(name, args=args))
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+    async def test_lists_use_keyset_pages(self):
+        for code in ('AA-1', 'BB-2', 'CC-3'):
+            await Vehicle.objects.acreate(name='Truck ' + code, code=code, license_plate=code)
+        page = json.loads((await self.get(reverse('async_vehicle_list'), {'limit': 2})).content)
+        self.assertEqual([vehicle['code'] for vehicle in page['results']], ['CC-3', 'BB-2'])
+        page = json.loads((await self.get(page['next'])).content)
+        self.assertEqual([vehicle['code'] for vehicle in page['results']], ['AA-1'])
+        response = await self.get(reverse('async_vehicle_list'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_authentication(self):
+        url = reverse('async_product_detail', args=[self.product.pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 403)
+        response = await self.get(url, Authorization='Token wrong')
+        self.assertEqual(json.loads(response.content), {'detail': 'Invalid token.'})
+        # The product list is public, like its sync counterpart
+        response = await self.async_client.get(reverse('async_product_list'))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_conditional_get_and_errors(self):
+        url = reverse('async_product_detail', args=[self.product.pk])
+        etag = (await self.get(url))['ETag']
+        response = await self.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = await self.get(reverse('async_product_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.status_code, 405)
+
+
+class SQLiteBackendTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'scratch.sqlite3')
+        self.wrapper = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': self.path,
+            'OPTIONS': {
+                'timeout': 0,
+                'transaction_mode': 'immediate',
+                'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -2048},
+            },
+        }, alias='scratch')
+        self.addCleanup(self.wrapper.close)
+
+    def pragma(self, name):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_set_on_connect(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('cache_size'), -2048)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        self.wrapper.ensure_connection()
+        self.wrapper._start_transaction_under_autocommit()
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('BEGIN IMMEDIATE')
+        self.wrapper.connection.rollback()
+
+    def test_invalid_transaction_mode(self):
+        self.wrapper.settings_dict['OPTIONS']['transaction_mode'] = 'eventually'
+        with self.assertRaises(ImproperlyConfigured):
+            self.wrapper.ensure_connection()
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.middleware = ReplicaReadMiddleware(lambda request: HttpResponse(str(reading_from_replica())))
+        self.factory = RequestFactory()
+
+    def test_reads_outside_transactions_go_to_the_replica(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+            with primary_reads():
+                self.assertEqual(router.db_for_read(Product), 'default')
+
+    def test_safe_requests_read_from_the_replica(self):
+        self.assertEqual(self.middleware(self.factory.get('/')).content, b'True')
+        self.assertEqual(self.middleware(self.factory.get('/', {'primary': '1'})).content, b'False')
+        self.assertEqual(self.middleware(self.factory.get('/', HTTP_X_READ_PRIMARY='1')).content, b'False')
+
+    def test_clients_read_their_writes(self):
+        response = self.middleware(self.factory.post('/'))
+        self.assertEqual(response.content, b'False')
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'], 5)
+        self.factory.cookies[PRIMARY_COOKIE] = '1'
+        self.assertEqual(self.middleware(self.factory.get('/')).content, b'False')
+
+
+class ReplicaTransactionTests(InventoryAPITestCase):
+
+    def test_reads_in_a_primary_transaction_stay_on_the_primary(self):
+        with replica_reads():
+            self.assertEqual(ReplicaRouter().db_for_read(Product), 'default')
+            response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ReplicaReadTests(TransactionTestCase):
+    """Requests against a real, read-only second connection (outside a test transaction)."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # In tests the replica mirrors the default database; make it read-only like the real one
+        replica = connections['replica']
+        mirrored = replica.settings_dict
+        replica.close()
+        replica.settings_dict = {**mirrored, 'OPTIONS': {**mirrored['OPTIONS'], 'pragmas': {'query_only': 'ON'}}}
+        self.addCleanup(setattr, replica, 'settings_dict', mirrored)
+        self.addCleanup(replica.close)
+
+        self.user = User.objects.create_user('staff', password='secret')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(
+            name='Oil filter', reference='OF-100', unit_price=Decimal('10.00'), min_quantity=5, low_quantity=10,
+        )
+        order = Order.objects.create(supplier=Supplier.objects.create(name='Acme Parts'))
+        OrderItem.objects.create(Order=order, product=self.product, quantity=2)
+
+    def queries_on(self, alias, url, **params):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            response = self.client.get(url, params)
+            # Streamed bodies run their query while being consumed
+            b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_safe_requests_read_from_the_replica(self):
+        for url in (reverse('product_list'), reverse('order_list')):
+            self.assertTrue(any('FROM "inventory_' in sql for sql in self.queries_on('replica', url)))
+            self.assertEqual(self.queries_on('default', url), [])
+        primary = self.queries_on('default', reverse('product_list'), primary=1)
+        self.assertTrue(any('"inventory_product"' in sql for sql in primary))
+
+    def test_streamed_exports_read_from_the_replica(self):
+        for name in ('order_export', 'stock_export'):
+            url = reverse(name) + '?format=csv'
+            self.assertTrue(any('"inventory_' in sql for sql in self.queries_on('replica', url)))
+            self.assertEqual(self.queries_on('default', url), [])
+
+    def test_writes_during_a_safe_request_go_to_the_primary(self):
+        def view(request):
+            # A ledger write, bumping the Product version token, amid replica reads
+            adjust(Product.objects.get(pk=self.product.pk), 3)
+            request.session['seen'] = True
+            return HttpResponse(str(reading_from_replica()))
+
+        request = RequestFactory().get('/')
+        stack = SessionMiddleware(ReplicaReadMiddleware(view))
+        request.user = self.user
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = stack(request)
+        self.assertEqual(response.content, b'True')
+        self.assertTrue(any('"inventory_product"' in query['sql'] for query in replica.captured_queries))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).current_quantity, 3)
+        with self.assertRaisesMessage(OperationalError, 'readonly'):
+            connections['replica'].cursor().execute('DELETE FROM inventory_product')
+
+
+@override_settings(QUERY_PROFILING_SAMPLE_RATE=1, QUERY_PROFILING_MAX_DUPLICATES=3)
+class QueryProfilingTests(InventoryAPITestCase):
+
+    def test_fingerprints_ignore_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+
+    def test_server_timing_header(self):
+        self.make_product()
+        response = self.client.get(reverse('product_list'))
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, render;dur=[\d.]+, app;dur=-?[\d.]+, total;',
+        )
+
+    def test_serialization_is_timed(self):
+        product = self.make_product()
+
+        class SlowSerializer(serializers.Serializer):
+            name = serializers.SerializerMethodField()
+
+            def get_name(self, product):
+                time.sleep(0.02)
+                return product.name
+
+        def view(request):
+            return HttpResponse(json.dumps(serialize(SlowSerializer([product, product], many=True))))
+
+        response = QueryProfilingMiddleware(view)(RequestFactory().get('/products/'))
+        duration = float(response['Server-Timing'].split('serialize;dur=')[1].split(',')[0])
+        self.assertGreaterEqual(duration, 40)
+
+    def test_serialization_is_only_reported_by_views_measuring_it(self):
+        product = self.make_product()
+
+        def view(request):
+            return HttpResponse(ProductSerializer(product).data['name'])
+
+        response = QueryProfilingMiddleware(view)(RequestFactory().get('/products/'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", render;dur=')
+
+    @override_settings(QUERY_PROFILING_MAX_QUERIES=1)
+    def test_streamed_responses_are_profiled_until_closed(self):
+        self.make_product()
+        with self.assertNoLogs('inventory.middleware', 'WARNING'):
+            response = self.client.get(reverse('stock_export'))
+        self.assertNotIn('Server-Timing', response)
+        with self.assertLogs('inventory.middleware', 'WARNING') as logs:
+            b''.join(response.streaming_content)
+        self.assertIn('GET /api/v1/exports/stock/: 1 queries', logs.output[0])
+
+    def test_repeated_queries_are_logged(self):
+        products = [self.make_product(reference=f'R-{index}') for index in range(4)]
+
+        def view(request):
+            for product in products:
+                Product.objects.filter(pk=product.pk).exists()
+            return HttpResponse()
+
+        with self.assertLogs('inventory.middleware', 'WARNING') as logs:
+            QueryProfilingMiddleware(view)(RequestFactory().get('/products/'))
+        self.assertIn('GET /products/: 4 queries', logs.output[0])
+        self.assertIn('repeated 4x: SELECT', logs.output[0])
+
+    @override_settings(QUERY_PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_left_alone(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertNotIn('Server-Timing', response)
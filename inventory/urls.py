@@ -1,13 +1,20 @@
 from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
+from inventory import async_views
 from inventory.views import (
     ProductListAPIView,
     ProductDetailAPIView,
+    LowStockProductListAPIView,
+    ProductSearchAPIView,
+    ProductLookupAPIView,
+    ProductForecastListAPIView,
     SupplierListAPIView,
     SupplierDetailAPIView,
     OrderListAPIView,
     OrderDetailAPIView,
     OrderCreateAPIView,
+    OrderWithItemsCreateAPIView,
+    ReorderPlanAPIView,
     OrderUpdateAPIView,
     OrderDeleteAPIView,
     OrderItemListAPIView,
@@ -23,20 +30,39 @@ from inventory.views import (
     ReparationProductListCreateAPIView,
     ReparationProductRetrieveUpdateDestroyAPIView,
     ReparationProductListAPIView,
+    ProductBulkUpsertAPIView,
+    SupplierBulkUpsertAPIView,
+    VehicleBulkUpsertAPIView,
+    DriverBulkUpsertAPIView,
+    OrderExportAPIView,
+    ReparationExportAPIView,
+    StockExportAPIView,
+    StockMovementListCreateAPIView,
+    CacheStatsAPIView,
+    VehicleCostAPIView,
+    DashboardAPIView,
 )
 
 urlpatterns = [
     # Product urls
     path('products/', ProductListAPIView.as_view(), name='product_list'),
     path('products/<int:pk>/', ProductDetailAPIView.as_view(), name='product_detail'),
+    path('products/bulk-upsert/', ProductBulkUpsertAPIView.as_view(), name='product_bulk_upsert'),
+    path('products/low-stock/', LowStockProductListAPIView.as_view(), name='product_low_stock'),
+    path('products/search/', ProductSearchAPIView.as_view(), name='product_search'),
+    path('products/lookup/', ProductLookupAPIView.as_view(), name='product_lookup'),
+    path('products/forecast/', ProductForecastListAPIView.as_view(), name='product_forecast'),
 
     # Supplier urls
     path('suppliers/', SupplierListAPIView.as_view(), name='supplier_list'),
     path('suppliers/<int:pk>/', SupplierDetailAPIView.as_view(), name='supplier_detail'),
+    path('suppliers/bulk-upsert/', SupplierBulkUpsertAPIView.as_view(), name='supplier_bulk_upsert'),
 
     # Order urls
     path('orders/', OrderListAPIView.as_view(), name='order_list'),
     path('orders/create/', OrderCreateAPIView.as_view(), name='order_create'),
+    path('orders/create-with-items/', OrderWithItemsCreateAPIView.as_view(), name='order_create_with_items'),
+    path('orders/reorder-plan/', ReorderPlanAPIView.as_view(), name='order_reorder_plan'),
     path('orders/<int:pk>/', OrderDetailAPIView.as_view(), name='order_detail'),
     path('orders/<int:pk>/update/', OrderUpdateAPIView.as_view(), name='order_update'),
     path('orders/<int:pk>/delete/', OrderDeleteAPIView.as_view(), name='order_delete'),
@@ -54,15 +80,42 @@ urlpatterns = [
     # Vehicle urls
     path('vehicles/', VehicleListAPIView.as_view(), name='vehicle_list'),
     path('vehicles/<int:pk>/', VehicleDetailAPIView.as_view(), name='vehicle_detail'),
+    path('vehicles/bulk-upsert/', VehicleBulkUpsertAPIView.as_view(), name='vehicle_bulk_upsert'),
 
     # Driver urls
     path('drivers/', DriverListAPIView.as_view(), name='driver_list'),
     path('drivers/<int:pk>/', DriverDetailAPIView.as_view(), name='driver_detail'),
+    path('drivers/bulk-upsert/', DriverBulkUpsertAPIView.as_view(), name='driver_bulk_upsert'),
 
     # Reparation urls
     path('reparation_products/create/', ReparationProductListCreateAPIView.as_view(), name='reparation_product_list_create'),
     path('reparation_products/<int:pk>/', ReparationProductRetrieveUpdateDestroyAPIView.as_view(), name='reparation_product_retrieve_update_destroy'),
     path('reparation_products/list/', ReparationProductListAPIView.as_view(), name='reparation_product_list'),
+
+    # Stock urls
+    path('stock/movements/', StockMovementListCreateAPIView.as_view(), name='stock_movement_list_create'),
+
+    # Analytics urls
+    path('analytics/dashboard/', DashboardAPIView.as_view(), name='dashboard'),
+    path('analytics/vehicle-costs/', VehicleCostAPIView.as_view(), name='vehicle_costs'),
+
+    # Cache urls
+    path('cache/stats/', CacheStatsAPIView.as_view(), name='cache_stats'),
+
+    # Async read urls, served without blocking by the ASGI application
+    path('async/products/', async_views.product_list, name='async_product_list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async_product_detail'),
+    path('async/products/low-stock/', async_views.low_stock_product_list, name='async_product_low_stock'),
+    path('async/orders/<int:pk>/', async_views.order_detail, name='async_order_detail'),
+    path('async/vehicles/', async_views.vehicle_list, name='async_vehicle_list'),
+    path('async/vehicles/<int:pk>/', async_views.vehicle_detail, name='async_vehicle_detail'),
+    path('async/drivers/', async_views.driver_list, name='async_driver_list'),
+    path('async/drivers/<int:pk>/', async_views.driver_detail, name='async_driver_detail'),
+
+    # Export urls
+    path('exports/orders/', OrderExportAPIView.as_view(), name='order_export'),
+    path('exports/reparations/', ReparationExportAPIView.as_view(), name='reparation_export'),
+    path('exports/stock/', StockExportAPIView.as_view(), name='stock_export'),
 ]
 
 
@@ -1,19 +1,40 @@
+import datetime as dt
+from django.db.models import (DecimalField, ExpressionWrapper, F, Max, Min, OuterRef, Subquery, Sum,
+                              prefetch_related_objects)
+from django.db.models.functions import TruncQuarter
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from .models import Product, Supplier, Order, OrderItem, Invoice, Vehicle, Driver, ReparationProduct
-from .serializers import (ProductSerializer, SupplierSerializer, OrderSerializer,
-                          OrderItemSerializer, InvoiceSerializer, VehicleSerializer, DriverSerializer, ReparationProductListCreateSerializer, ReparationProductRetrieveUpdateDestroySerializer)
+from .models import Product, Supplier, Order, OrderItem, Invoice, ReparationInvoice, Vehicle, Driver, ReparationProduct, ReparationProductItem, StockMovement, VehicleCostRollup, ProductForecast
+from .serializers import (ProductSerializer, SupplierSerializer, OrderSerializer, OrderReadSerializer,
+                          OrderWithItemsCreateSerializer, OrderItemSerializer, InvoiceSerializer, VehicleSerializer, DriverSerializer, ReparationProductListCreateSerializer, ReparationProductRetrieveUpdateDestroySerializer,
+                          ProductUpsertSerializer, SupplierUpsertSerializer, VehicleUpsertSerializer, DriverUpsertSerializer,
+                          StockMovementSerializer, LowStockProductSerializer, ReorderLineSerializer, VehicleCostSerializer,
+                          ProductForecastSerializer)
 
 from django.contrib.auth.decorators import login_required
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.views.generic import UpdateView
 from django.contrib.auth.models import User
 from .models import UserProfile
+from .pagination import OrderKeysetPagination, ReparationKeysetPagination, LowStockKeysetPagination, ForecastKeysetPagination
+from .exports import CSVRenderer, NDJSONRenderer, stream_rows
+from .reorder import plan_reorders, reorder
+from .search import search_products, search_terms
+from .lookup import lookup_products
+from .dashboard import cached_summary
+from .cache import CachedResponseMixin, ConditionalGetMixin, cache_stats
+from .middleware import SerializationTimingMixin
 
 
 
@@ -29,45 +50,146 @@ class UserProfileView(LoginRequiredMixin, UpdateView):
         return self.request.user.userprofile
 
 # Product views
-class ProductListAPIView(generics.ListAPIView):
+class ProductListAPIView(ConditionalGetMixin, CachedResponseMixin, SerializationTimingMixin, generics.ListAPIView):
+    cache_models = (Product,)
     permission_classes = [AllowAny]
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
 
-class ProductDetailAPIView(generics.RetrieveAPIView):
+class ProductDetailAPIView(ConditionalGetMixin, CachedResponseMixin, SerializationTimingMixin, generics.RetrieveAPIView):
+    cache_models = (Product,)
     permission_classes = [IsAuthenticated]
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
 
+# Products at or below low_quantity, most urgent (lowest stock margin) first
+class LowStockProductListAPIView(SerializationTimingMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = LowStockProductSerializer
+    pagination_class = LowStockKeysetPagination
+    queryset = Product.objects.low_stock()
+
+# Products expected to run out, soonest first; ?within=<days> limits the horizon.
+# Computed by the forecast_stock command.
+class ProductForecastListAPIView(SerializationTimingMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ProductForecastSerializer
+    pagination_class = ForecastKeysetPagination
+
+    def get_queryset(self):
+        queryset = ProductForecast.objects.filter(days_of_cover__isnull=False).select_related('product')
+        within = self.request.query_params.get('within')
+        if within:
+            if not within.isdigit():
+                raise ValidationError({'within': 'Expected a number of days.'})
+            queryset = queryset.filter(days_of_cover__lte=int(within))
+        return queryset
+
+# Ranked prefix search over name, reference and SKU, e.g. ?q=oil fil&limit=10
+class ProductSearchAPIView(CachedResponseMixin, SerializationTimingMixin, generics.ListAPIView):
+    cache_models = (Product,)
+    permission_classes = [IsAuthenticated]
+    serializer_class = ProductSerializer
+    pagination_class = None
+    default_limit = 20
+    max_limit = 100
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '')
+        if not search_terms(query):
+            raise ValidationError({'q': 'Expected at least one search term.'})
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Expected a number.'})
+        return search_products(query, limit=max(1, min(limit, self.max_limit)))
+
+# Scanner lookups by SKU or reference: GET ?code=A&code=B or POST {"codes": [...]}
+class ProductLookupAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    max_codes = 500
+
+    def get(self, request, *args, **kwargs):
+        codes = [code for value in request.query_params.getlist('code') for code in value.split(',')]
+        return self.lookup(codes)
+
+    def post(self, request, *args, **kwargs):
+        codes = request.data.get('codes') if isinstance(request.data, dict) else None
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            raise ValidationError({'codes': 'Expected a list of codes.'})
+        return self.lookup(codes)
+
+    def lookup(self, codes):
+        codes = list(dict.fromkeys(code.strip() for code in codes if code.strip()))
+        if not codes:
+            raise ValidationError({'codes': 'Expected at least one code.'})
+        if len(codes) > self.max_codes:
+            raise ValidationError({'codes': f'At most {self.max_codes} codes per request.'})
+        products = lookup_products(codes)
+        return Response({
+            'products': {code: product for code, product in products.items() if product is not None},
+            'missing': [code for code in codes if products[code] is None],
+        })
+
 # Supplier views
-class SupplierListAPIView(generics.ListAPIView):
+class SupplierListAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_models = (Supplier,)
     permission_classes = [IsAuthenticated]
     serializer_class = SupplierSerializer
     queryset = Supplier.objects.all()
 
-class SupplierDetailAPIView(generics.RetrieveAPIView):
+class SupplierDetailAPIView(CachedResponseMixin, generics.RetrieveAPIView):
+    cache_models = (Supplier,)
     permission_classes = [IsAuthenticated]
     serializer_class = SupplierSerializer
     queryset = Supplier.objects.all()
 
 # Order views
-class OrderListAPIView(generics.ListAPIView):
+class OrderListAPIView(ConditionalGetMixin, SerializationTimingMixin, generics.ListAPIView):
+    cache_models = (Order, Product)
     authentication_classes = [SessionAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticated]
-    queryset = Order.objects.all()
-    serializer_class = OrderSerializer
+    queryset = Order.objects.with_items()
+    serializer_class = OrderReadSerializer
+    pagination_class = OrderKeysetPagination
 
 
-class OrderDetailAPIView(generics.RetrieveAPIView):
+class OrderDetailAPIView(ConditionalGetMixin, SerializationTimingMixin, generics.RetrieveAPIView):
+    cache_models = (Order, Product)
     permission_classes = [IsAuthenticated]
-    serializer_class = OrderSerializer
-    queryset = Order.objects.all()
+    serializer_class = OrderReadSerializer
+    queryset = Order.objects.with_items()
 
 class OrderCreateAPIView(generics.CreateAPIView):   
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
     queryset = Order.objects.all()
 
+# Creates an order together with all of its line items in one transaction
+class OrderWithItemsCreateAPIView(generics.CreateAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderWithItemsCreateSerializer
+    queryset = Order.objects.all()
+
+# GET previews the reorder plan, POST creates one pending order per supplier
+class ReorderPlanAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        lines, unassigned = plan_reorders()
+        return Response({
+            'lines': ReorderLineSerializer(lines, many=True).data,
+            'unassigned': [product.pk for product in unassigned],
+        })
+
+    def post(self, request, *args, **kwargs):
+        orders, unassigned = reorder()
+        prefetch_related_objects(orders, Order.objects.items_prefetch())
+        return Response({
+            'orders': OrderReadSerializer(orders, many=True).data,
+            'unassigned': [product.pk for product in unassigned],
+        }, status=201 if orders else 200)
+
 class OrderUpdateAPIView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
@@ -111,23 +233,83 @@ class InvoiceDetailAPIView(generics.RetrieveAPIView):
     queryset = Invoice.objects.all()
 
 # Vehicle views
-class VehicleListAPIView(generics.ListAPIView):
+class VehicleListAPIView(ConditionalGetMixin, CachedResponseMixin, SerializationTimingMixin, generics.ListAPIView):
+    cache_models = (Vehicle,)
     permission_classes = [IsAuthenticated]
     serializer_class = VehicleSerializer
     queryset = Vehicle.objects.all()
 
-class VehicleDetailAPIView(generics.RetrieveAPIView):
+class VehicleDetailAPIView(ConditionalGetMixin, CachedResponseMixin, SerializationTimingMixin, generics.RetrieveAPIView):
+    cache_models = (Vehicle,)
     permission_classes = [IsAuthenticated]
     serializer_class = VehicleSerializer
     queryset = Vehicle.objects.all()
 
+# Operations dashboard figures, reused for DASHBOARD_CACHE_TIMEOUT seconds
+class DashboardAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cached_summary())
+
+# Fleet costs from the monthly rollups: ?group=month|quarter|total&from=YYYY-MM&to=YYYY-MM&vehicle=<id>
+class VehicleCostAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    groups = ('month', 'quarter', 'total')
+
+    def get(self, request, *args, **kwargs):
+        group = request.query_params.get('group', 'month')
+        if group not in self.groups:
+            raise ValidationError({'group': f"Expected one of {', '.join(self.groups)}."})
+        rollups = VehicleCostRollup.objects.filter(**self.get_filters(request))
+
+        columns = ['vehicle', 'vehicle__name']
+        if group == 'month':
+            rollups = rollups.annotate(bucket=F('period'))
+        elif group == 'quarter':
+            rollups = rollups.annotate(bucket=TruncQuarter('period'))
+        if group != 'total':
+            columns.append('bucket')
+        rows = (
+            rollups.values(*columns)
+            .annotate(
+                total_cost=Sum('total_cost'),
+                reparations=Sum('reparations'),
+                min_odometer=Min('min_odometer'),
+                max_odometer=Max('max_odometer'),
+            )
+            .order_by(*columns[2:], 'vehicle')
+        )
+        for row in rows:
+            row['period'] = row.pop('bucket', None)
+        return Response({'results': VehicleCostSerializer(rows, many=True, context={'group': group}).data})
+
+    def get_filters(self, request):
+        filters = {}
+        for param, lookup in (('from', 'period__gte'), ('to', 'period__lte')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                filters[lookup] = dt.datetime.strptime(value, '%Y-%m').date()
+            except ValueError:
+                raise ValidationError({param: 'Expected a month formatted YYYY-MM.'})
+        vehicle = request.query_params.get('vehicle')
+        if vehicle:
+            if not vehicle.isdigit():
+                raise ValidationError({'vehicle': 'Expected a vehicle id.'})
+            filters['vehicle_id'] = vehicle
+        return filters
+
 # Driver views
-class DriverListAPIView(generics.ListAPIView):
+class DriverListAPIView(CachedResponseMixin, SerializationTimingMixin, generics.ListAPIView):
+    cache_models = (Driver,)
     permission_classes = [IsAuthenticated]
     serializer_class = DriverSerializer
     queryset = Driver.objects.all()
 
-class DriverDetailAPIView(generics.RetrieveAPIView):
+class DriverDetailAPIView(CachedResponseMixin, SerializationTimingMixin, generics.RetrieveAPIView):
+    cache_models = (Driver,)
     permission_classes = [IsAuthenticated]
 
     serializer_class = DriverSerializer
@@ -136,8 +318,9 @@ class DriverDetailAPIView(generics.RetrieveAPIView):
 
 class ReparationProductListCreateAPIView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
-    queryset = ReparationProduct.objects.all()
+    queryset = ReparationProduct.objects.prefetch_related('reparationproductitem_set')
     serializer_class = ReparationProductListCreateSerializer
+    pagination_class = ReparationKeysetPagination
 
     def perform_create(self, serializer):
         # Automatically set the driver to the current user
@@ -148,18 +331,187 @@ class ReparationProductListCreateAPIView(generics.ListCreateAPIView):
 
 
 class ReparationProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ReparationProduct.objects.all()
+    queryset = ReparationProduct.objects.prefetch_related('reparationproductitem_set')
     serializer_class = ReparationProductRetrieveUpdateDestroySerializer
     permission_classes = [IsAuthenticated]
 
-    def perform_update(self, serializer):
-        # Recalculate the total price when quantity or product changes
-        if 'quantity' in serializer.validated_data or 'product' in serializer.validated_data:
-            instance = serializer.save()
-            instance.total_price = instance.product.unit_price * instance.quantity
-            instance.save()
-
 class ReparationProductListAPIView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
-    queryset = ReparationProduct.objects.all()
+    queryset = ReparationProduct.objects.prefetch_related('reparationproductitem_set')
     serializer_class = ReparationProductListCreateSerializer
+    pagination_class = ReparationKeysetPagination
+
+
+# Stock ledger views, filter with ?product=<id>
+class StockMovementListCreateAPIView(generics.ListCreateAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = StockMovementSerializer
+
+    def get_queryset(self):
+        queryset = StockMovement.objects.all()
+        product = self.request.query_params.get('product')
+        if product:
+            if not product.isdigit():
+                raise ValidationError({'product': 'Expected a product id.'})
+            queryset = queryset.filter(product_id=product)
+        return queryset
+
+# Hit/miss counters of the catalog response cache in this process
+class CacheStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache_stats())
+
+
+# Batch upsert views for catalog syncs, the body is a list of rows
+class BulkUpsertAPIView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.counts)
+
+
+class ProductBulkUpsertAPIView(BulkUpsertAPIView):
+    serializer_class = ProductUpsertSerializer
+
+
+class SupplierBulkUpsertAPIView(BulkUpsertAPIView):
+    serializer_class = SupplierUpsertSerializer
+
+
+class VehicleBulkUpsertAPIView(BulkUpsertAPIView):
+    serializer_class = VehicleUpsertSerializer
+
+
+class DriverBulkUpsertAPIView(BulkUpsertAPIView):
+    serializer_class = DriverUpsertSerializer
+
+
+# Export views stream CSV (default) or NDJSON, pick one with the Accept
+# header, ?format= or a .csv/.ndjson suffix. Use ?date_from= and ?date_to=
+# (YYYY-MM-DD, inclusive) to limit the range.
+class ExportAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+    date_field = None
+    columns = {}
+    filename = None
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def filter_dates(self, queryset):
+        bounds = {}
+        for param, lookup, shift in (('date_from', 'gte', 0), ('date_to', 'lt', 1)):
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError({param: 'Expected a date formatted YYYY-MM-DD.'})
+            start = dt.datetime.combine(day + dt.timedelta(days=shift), dt.time())
+            bounds[f'{self.date_field}__{lookup}'] = timezone.make_aware(start)
+        return queryset.filter(**bounds)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Errors are not exports, render them as JSON whatever was asked for
+        if getattr(response, 'exception', False):
+            request.accepted_renderer, request.accepted_media_type = JSONRenderer(), JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        if self.date_field:
+            queryset = self.filter_dates(queryset)
+        return stream_rows(queryset, self.columns, request.accepted_renderer.format, self.filename)
+
+
+def line_total_expression(quantity='quantity', unit_price='product__unit_price'):
+    return ExpressionWrapper(F(quantity) * F(unit_price), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def first_invoice_number(invoices):
+    return Subquery(invoices.order_by('id').values('invoice_number')[:1])
+
+
+class OrderExportAPIView(ExportAPIView):
+    date_field = 'Order__date_ordered'
+    filename = 'orders'
+    # The first columns match the import_history input format
+    columns = {
+        'order_number': 'Order__order_number',
+        'supplier': 'Order__supplier__name',
+        'date_ordered': 'Order__date_ordered',
+        'date_delivered': 'Order__date_delivered',
+        'status': 'Order__status',
+        'is_delivered': 'Order__is_delivered',
+        'delivery_order_number': 'Order__delivery_order_number',
+        'product_reference': 'product__reference',
+        'quantity': 'quantity',
+        'product_name': 'product__name',
+        'unit_price': 'product__unit_price',
+        'line_total': 'line_total',
+        'order_total': 'Order__total_price',
+        'invoice_number': 'invoice_number',
+    }
+
+    def get_queryset(self):
+        return OrderItem.objects.annotate(
+            line_total=line_total_expression(),
+            # An order can have several invoices; joining them would repeat its lines
+            invoice_number=first_invoice_number(Invoice.objects.filter(order=OuterRef('Order_id'))),
+        ).order_by('Order_id', 'id')
+
+
+class ReparationExportAPIView(ExportAPIView):
+    date_field = 'reparation_product__date_repaired'
+    filename = 'reparations'
+    columns = {
+        'license_plate': 'reparation_product__vehicle__license_plate',
+        'driver': 'reparation_product__driver__name',
+        'date_repaired': 'reparation_product__date_repaired',
+        'odometer': 'reparation_product__odometer',
+        'location': 'reparation_product__location',
+        'product_reference': 'product__reference',
+        'quantity': 'quantity',
+        'vehicle': 'reparation_product__vehicle__name',
+        'product_name': 'product__name',
+        'unit_price': 'product__unit_price',
+        'line_total': 'line_total',
+        'reparation_total': 'reparation_product__total_price',
+        'invoice_number': 'invoice_number',
+    }
+
+    def get_queryset(self):
+        return ReparationProductItem.objects.annotate(
+            line_total=line_total_expression(),
+            invoice_number=first_invoice_number(
+                ReparationInvoice.objects.filter(reparation=OuterRef('reparation_product_id')),
+            ),
+        ).order_by('reparation_product_id', 'id')
+
+
+class StockExportAPIView(ExportAPIView):
+    filename = 'stock'
+    columns = {
+        'SKU': 'SKU',
+        'reference': 'reference',
+        'name': 'name',
+        'current_quantity': 'current_quantity',
+        'min_quantity': 'min_quantity',
+        'low_quantity': 'low_quantity',
+        'unit_price': 'unit_price',
+        'stock_value': 'stock_value',
+    }
+
+    def get_queryset(self):
+        return Product.objects.annotate(
+            stock_value=line_total_expression('current_quantity', 'unit_price'),
+        ).order_by('id')
@@ -0,0 +1,41 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The sqlite3 backend with two more OPTIONS, both removed before the
+    remaining ones are passed to sqlite3.connect():
+
+    - 'pragmas': mapping of PRAGMA names to values, set on every new
+      connection (e.g. {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}).
+    - 'transaction_mode': how atomic() begins transactions. With IMMEDIATE
+      a writer takes the write lock up front and waits for it (up to the
+      'timeout' option) instead of failing with "database is locked" when
+      it upgrades a read transaction that another writer got ahead of.
+    """
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = dict(options.get('pragmas', {}))
+        self.transaction_mode = options.get('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"DATABASES['{self.alias}']['OPTIONS']['transaction_mode'] must be one of "
+                f"{', '.join(TRANSACTION_MODES)}."
+            )
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
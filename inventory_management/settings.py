@@ -43,7 +43,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so the queries of every other middleware are profiled too
+    'inventory.middleware.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before the session and auth middleware so their reads use the replica too
+    'inventory.middleware.ReplicaReadMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,13 +81,88 @@ WSGI_APPLICATION = 'inventory_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# The SQLite engine in inventory_management/db/sqlite3 also applies 'pragmas'
+# to every connection and begins atomic() blocks in 'transaction_mode'.
+# 'timeout' is how long (in seconds) a connection waits for a lock held by
+# another one before raising "database is locked". WAL lets readers run
+# alongside the writer, and connections are kept for CONN_MAX_AGE seconds
+# instead of being opened on every request.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'inventory_management.db.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'mmap_size': 256 * 1024 * 1024,
+                # Negative sizes are in KiB, so 64 MiB of page cache
+                'cache_size': -64 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        },
     }
 }
 
+# Safe (GET/HEAD/OPTIONS) requests read through a second, read-only
+# connection to the same file, so long reports and exports never hold up
+# order and reparation writes; see inventory/routers.py. Point NAME at a
+# snapshot copy to move them off the primary file entirely.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'OPTIONS': {
+        **DATABASES['default']['OPTIONS'],
+        'transaction_mode': 'DEFERRED',
+        'pragmas': {**DATABASES['default']['OPTIONS']['pragmas'], 'query_only': 'ON'},
+    },
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['inventory.routers.ReplicaRouter']
+
+# Seconds a client reads from the primary after one of its writes
+REPLICA_READ_YOUR_WRITES_SECONDS = 5
+
+# Share of the requests profiled by inventory.middleware.QueryProfilingMiddleware,
+# and the thresholds above which a profiled request is logged: total time,
+# query count, and executions of one statement (the usual sign of an N+1)
+QUERY_PROFILING_SAMPLE_RATE = 0.05
+QUERY_PROFILING_SLOW_MS = 500
+QUERY_PROFILING_MAX_QUERIES = 50
+QUERY_PROFILING_MAX_DUPLICATES = 5
+
+
+# Cache
+# Bounded in-process cache for the catalog responses, see inventory/cache.py.
+# Entries are keyed on version tokens kept in the database, so each worker
+# process may keep its own; a shared backend only improves the hit ratio.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'inventory',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 3,
+        },
+    }
+}
+
+CATALOG_CACHE_TIMEOUT = 300
+
+# Products kept in the in-process LRU behind products/lookup/
+PRODUCT_LOOKUP_CACHE_SIZE = 4096
+# Seconds a cached lookup may be served, whatever the Product version
+PRODUCT_LOOKUP_CACHE_TTL = 60
+
+# Seconds the operations dashboard summary is cached, 0 to disable
+DASHBOARD_CACHE_TIMEOUT = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -137,5 +216,10 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'inventory.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Upper bound for the ?limit= page size accepted by the list endpoints
+PAGINATION_MAX_PAGE_SIZE = 500
+